@@ -1,26 +1,37 @@
 import sys
+import json
 import time
+import signal
+import asyncio
 import logging
 import threading
 
-from datetime import datetime
 from enum import Enum
 
-from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client import InfluxDBClient
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
 
 import uvicorn
 
-from wiretap.remote import remote_execution, ALL_COLLECTORS
+from wiretap.remote import remote_execution, is_localhost, ALL_COLLECTORS
+from wiretap.fleet import fleet_execution
+from wiretap.collectors import prepare
 from wiretap.schemas import Metric
 from wiretap.config import settings
-from wiretap.health import health_check, certificate_check
+from wiretap.health import probe_inventory, CertificateCache
+from wiretap.writer import Writer
+from wiretap.dedup import DedupIndex
+from wiretap.lineprotocol import encode
+from wiretap.derive import Derive
+from wiretap.metriclog import MetricLog
+from wiretap.latest import LatestIndex
+from wiretap.stats import Stats
+from wiretap.tsdb import TimeSeriesStore
+from wiretap.rollup import Rollup
 from wiretap.utils import (
     read_config,
     read_inventory,
-    get_hashes,
-    set_hashes,
-    append_file,
     check_files,
 )
 
@@ -39,23 +50,40 @@ class Wiretap:
             collectors = ALL_COLLECTORS
         self.collectors = collectors
         self._startup_check()
-        self.hashes = get_hashes()
-        self.config = read_config()
+        self.hashes = DedupIndex()
+        self.config = prepare(read_config())
         self.inventory = read_inventory()
         self.metrics = []
-        self.diffs = {}
+        self.metric_log = MetricLog()
+        self.latest = LatestIndex()
+        self.stats = Stats()
+        self.tsdb = TimeSeriesStore() if settings.TSDB_ENABLED else None
+        self.rollup = Rollup() if settings.ROLLUP_ENABLED else None
+        self.rollup_bucket = (
+            settings.ROLLUP_BUCKET or f"{settings.INFLUX_BUCKET_PREFIX}_downsampled"
+        )
+        if self.stats.is_new():
+            self.stats.seed(*self.metric_log.stats())
+        self.derive = Derive()
+        self.certificates = CertificateCache()
 
         self.client = InfluxDBClient(
             url=settings.INFLUX_HOST, token=settings.INFLUX_TOKEN
         )
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        self.writer = Writer(self.write_api)
         self.query_api = self.client.query_api()
         self.bucket_api = self.client.buckets_api()
         self._db_check()
+        if self.rollup:
+            self.rollup_writer = Writer(
+                self.write_api, bucket=self.rollup_bucket, workers=1
+            )
 
-        self.diff_lock = threading.Lock()
         self.metric_lock = threading.Lock()
         self.threads = list()
+        self.schedules = {}
+        self.connections = {}
 
         self.RUNMODE = MODE.NORMAL
 
@@ -67,7 +95,20 @@ class Wiretap:
         self.start_server_threads()
 
     def start_server_threads(self):
-        for server in self.inventory:
+        servers = self.inventory
+        if settings.EXECUTION_MODE == "fleet":
+            fleet = [server for server in servers if not is_localhost(server)]
+            servers = [server for server in servers if is_localhost(server)]
+            if fleet:
+                fleet_thread = threading.Thread(
+                    target=fleet_execution,
+                    args=(fleet, self),
+                    name="thread_fleet",
+                    daemon=True,
+                )
+                self.threads.append(fleet_thread)
+                fleet_thread.start()
+        for server in servers:
             server_thread = threading.Thread(
                 target=remote_execution,
                 args=(server, self),
@@ -77,59 +118,167 @@ class Wiretap:
             self.threads.append(server_thread)
             server_thread.start()
 
-    def aggregate_diff(self, key, value):
-        last = self.diffs.get(key)
-        with self.diff_lock:
-            self.diffs[key] = value  # Trust no one
-        if last:
-            return value - last
-
-    def add_metric(self, server, metric):
-        log.debug(f"add_metric {metric}")
-        measurement = field_name = metric.tag
-        if name_tuple := metric.tag.split("_", 1):
-            if len(name_tuple) == 2:
-                measurement, field_name = name_tuple
-
-        if measurement in ["network"]:
-            metric.value = self.aggregate_diff(
-                server.name + measurement + field_name, metric.value
-            )
-            if not metric.value:
-                return None
-
-        metric.name = server.name
-        point = (
-            Point(measurement)
-            .tag("name", metric.name)
-            .tag("agg_type", metric.agg_type)
-            .field(field_name, metric.value)
-            .time(datetime.utcfromtimestamp(metric.time), WritePrecision.S)
-        )
-
-        if self.RUNMODE is MODE.NORMAL:
-            if self.add_hash(hash(str(point.__dict__))):
-                with self.metric_lock:
-                    self.add_point_to_db(point)
-                    self.metrics.append(metric.json())
-        else:
-            print(metric.json())
+    def add_metric(self, server, metric, collector: str = "health"):
+        self.add_metrics(server, [metric], collector)
 
-    def add_hash(self, hash: int):
-        """Returns true if hash is new, otherwise false. New hashes are added to the list"""
-        if hash in self.hashes:
-            return False
-        self.hashes.add(hash)
-        return True
+    def add_metrics(self, server, metrics, collector: str = "health"):
+        """Adds the *metrics* from one *collector* run on *server* as one batch
 
-    def add_point_to_db(self, point):
-        self.write_api.write(settings.INFLUX_BUCKET_PREFIX, settings.INFLUX_ORG, point)
+        Collectors with "rollup_only" in their config only send rollups to InfluxDB,
+        as long as rollups are enabled.
+        """
+        lines, accepted = [], []
+        duplicates = 0
+        metrics = self.derive.apply([m._replace(name=server.name) for m in metrics])
+        for metric in metrics:
+            log.debug(f"add_metric {metric}")
+            if not (line := encode(metric)):
+                continue
+
+            if self.RUNMODE is MODE.NORMAL:
+                if self.add_hash(line):
+                    lines.append(line)
+                    accepted.append(metric)
+                else:
+                    duplicates += 1
+            else:
+                print(json.dumps(metric._asdict()))
+
+        if lines or duplicates:
+            self.stats.add(server.name, collector, len(lines), duplicates)
+        if lines:
+            rollup_only = (self.config.get(collector) or {}).get("rollup_only")
+            if not (rollup_only and self.rollup):
+                self.add_lines_to_db(lines)
+            self.latest.update(accepted)
+            if self.tsdb:
+                self.tsdb.add(accepted)
+            if self.rollup:
+                self.rollup.add(accepted)
+            with self.metric_lock:
+                self.metrics.extend(accepted)
+
+    def add_hash(self, key: bytes):
+        """Returns true if key is new, otherwise false. New keys are added to the index"""
+        return self.hashes.add(key)
+
+    def add_lines_to_db(self, lines: list):
+        self.writer.put(lines)
+
+    def flush_rollups(self):
+        """Writes finished rollup windows to the rollup bucket and the local store"""
+        if not self.rollup:
+            return
+        lines, local = [], []
+        for window, metric in self.rollup.collect():
+            if line := encode(metric, window):
+                lines.append(line)
+                local.append(metric._replace(tag=f"{metric.tag}:{window}"))
+        if lines:
+            self.rollup_writer.put(lines)
+        if self.tsdb and local:
+            self.tsdb.add(local)
 
     def append_metrics(self):
-        print(f"Appending {len(self.metrics)} metrics")
         with self.metric_lock:
-            append_file(settings.metric_file, self.metrics)
-            self.metrics = []
+            metrics, self.metrics = self.metrics, []
+        print(f"Appending {len(metrics)} metrics")
+        lines = [json.dumps(metric._asdict()) for metric in metrics]
+        self.metric_log.append(lines)
+        self.stats.add_bytes(sum(len(line) + 1 for line in lines))
+
+    def schedule_stats(self) -> dict:
+        """Runs, missed and late runs per collector and host"""
+        return {
+            host: {c.__name__: stats for c, stats in scheduler.stats.items()}
+            for host, scheduler in self.schedules.items()
+        }
+
+    def connection_stats(self) -> dict:
+        """State, connects and reconnects of every ssh connection"""
+        return {name: c.stats() for name, c in list(self.connections.items())}
+
+    def health_checks(self):
+        """Probes every server in the inventory concurrently and stores the results"""
+        results = asyncio.run(
+            probe_inventory(self.inventory, certificates=self.certificates)
+        )
+        changed = self.certificates.pop_changes()
+        for server in self.inventory:
+            health_obj, certificate_obj = results[server.host]
+            now = int(time.time())
+            metrics = [
+                Metric(
+                    tag="health_http_status",
+                    time=now,
+                    value=health_obj.http_status,
+                    unit="boolean",
+                ),
+                Metric(
+                    tag="health_packet_loss",
+                    time=now,
+                    value=health_obj.packet_loss,
+                    unit="%",
+                ),
+            ]
+            if certificate_obj:
+                metrics.append(
+                    Metric(
+                        tag="certificate_expires_at",
+                        time=now,
+                        value=certificate_obj.expires_at,
+                        unit="timestamp",
+                    )
+                )
+                metrics.append(
+                    Metric(
+                        tag="certificate_expires_in",
+                        time=now,
+                        value=certificate_obj.expires_in,
+                        unit="s",
+                    )
+                )
+            if health_obj.http_time:
+                metrics.append(
+                    Metric(
+                        tag="health_http_time",
+                        time=now,
+                        value=health_obj.http_time,
+                        unit="ms",
+                    )
+                )
+            if server.host in changed:
+                metrics.append(
+                    Metric(
+                        tag="certificate_changed",
+                        time=now,
+                        value=1,
+                        agg_type="count",
+                    )
+                )
+            if health_obj.rtt:
+                metrics += [
+                    Metric(tag="health_rtt", time=now, value=health_obj.rtt, unit="ms"),
+                    Metric(
+                        tag="health_rtt_min",
+                        time=now,
+                        value=health_obj.rtt_min,
+                        unit="ms",
+                    ),
+                    Metric(
+                        tag="health_rtt_max",
+                        time=now,
+                        value=health_obj.rtt_max,
+                        unit="ms",
+                    ),
+                    Metric(
+                        tag="health_jitter",
+                        time=now,
+                        value=health_obj.jitter,
+                        unit="ms",
+                    ),
+                ]
+            self.add_metrics(server, metrics)
 
     def _startup_check(self):
         check_files()
@@ -138,14 +287,17 @@ class Wiretap:
         buckets = [x.name for x in self.bucket_api.find_buckets().buckets]
         assert settings.INFLUX_BUCKET_PREFIX in buckets
 
-        """ Fuckd library
-        if settings.INFLUX_BUCKET_PREFIX not in buckets:
-            self.bucket_api.create_bucket(settings.INFLUX_BUCKET_PREFIX,
-                                          retention_rules=BucketRetentionRules(type='expire', every_seconds=100000))
-        if settings.INFLUX_BUCKET_PREFIX+'_downsampled' not in buckets:
-            bucket = Bucket(name='ffdidd', retention_rules=BucketRetentionRules(type='expire', every_seconds=10000))
-            self.bucket_api.create_bucket(bucket)
-        """
+        if self.rollup and self.rollup_bucket not in buckets:
+            try:
+                self.bucket_api.create_bucket(
+                    bucket_name=self.rollup_bucket, org=settings.INFLUX_ORG
+                )
+            except ApiException as e:
+                log.error(
+                    f"Could not create the rollup bucket {self.rollup_bucket},"
+                    f" rollups are disabled. ({e.status}) {e.reason}"
+                )
+                self.rollup = None
 
 
 def run_webserver():
@@ -165,68 +317,34 @@ def run_main():
 
         engine = Wiretap(collectors=new_collectors)
 
+    stop = threading.Event()
+
     def main_loop(engine):
-        while True:
+        next_health = 0
+        while not stop.is_set():
             try:
                 if engine.RUNMODE is MODE.NORMAL:
-                    for server in engine.inventory:
-                        health_obj = health_check(server.host)
-                        engine.add_metric(
-                            server,
-                            Metric(
-                                tag="health_http_status",
-                                time=int(time.time()),
-                                value=health_obj.http_status,
-                                unit="boolean",
-                            ),
-                        )
-                        engine.add_metric(
-                            server,
-                            Metric(
-                                tag="health_packet_loss",
-                                time=int(time.time()),
-                                value=health_obj.packet_loss,
-                                unit="%",
-                            ),
-                        )
-                        certificate_obj = certificate_check(server.host)
-                        if certificate_obj:
-                            engine.add_metric(
-                                server,
-                                Metric(
-                                    tag="certificate_expires_at",
-                                    time=int(time.time()),
-                                    value=certificate_obj.expires_at,
-                                    unit="timestamp",
-                                ),
-                            )
-                            engine.add_metric(
-                                server,
-                                Metric(
-                                    tag="certificate_expires_in",
-                                    time=int(time.time()),
-                                    value=certificate_obj.expires_in,
-                                    unit="s",
-                                ),
-                            )
-                        if health_obj.rtt:
-                            engine.add_metric(
-                                server,
-                                Metric(
-                                    tag="health_rtt",
-                                    time=int(time.time()),
-                                    value=health_obj.rtt,
-                                    unit="ms",
-                                ),
-                            )
+                    if time.time() >= next_health:
+                        next_health = time.time() + settings.HEALTH_INTERVAL
+                        engine.health_checks()
 
                     for thread in engine.threads:
                         if not thread.is_alive():
                             log.error(f"{thread.name} has stopped!")
-                    set_hashes(engine.hashes)
+                    engine.hashes.flush()
+                    engine.flush_rollups()
+                    engine.latest.flush()
+                    if engine.tsdb:
+                        engine.tsdb.flush()
+                    engine.stats.flush(
+                        engine.writer,
+                        {
+                            "schedules": engine.schedule_stats(),
+                            "connections": engine.connection_stats(),
+                        },
+                    )
                     engine.append_metrics()
-                    for _ in range(10):
-                        time.sleep(1)
+                    stop.wait(10)
             except KeyboardInterrupt:
                 return
 
@@ -236,11 +354,20 @@ def run_main():
     engine.threads.append(main_loop_thread)
 
     main_loop_thread.start()
-
-    if sys.argv[-1] == "web":
-        run_webserver()
-
-    main_loop_thread.join()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        if sys.argv[-1] == "web":
+            run_webserver()
+
+        main_loop_thread.join()
+    finally:
+        stop.set()
+        main_loop_thread.join()
+        engine.writer.close()
+        if engine.rollup:
+            engine.flush_rollups()
+            engine.rollup_writer.close()
     exit()
 
     for thread in engine.threads:  # todo: Gracefull join threads?
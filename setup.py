@@ -19,6 +19,8 @@ setuptools.setup(
         "pydantic[dotenv]",
         "requests",
         "parallel-ssh",
+        "ssh2-python",
+        "gevent",
         "uvicorn",
         "fastapi",
         "aiofiles",
@@ -0,0 +1,44 @@
+from wiretap.derive import Derive, WRAP_32
+from wiretap.schemas import Metric
+
+
+def counter(time: int, value, epoch="boot") -> Metric:
+    return Metric(tag="network_eth0_rx_bytes", time=time, value=value, counter=epoch)
+
+
+def rates(*metrics) -> list:
+    derive = Derive()
+    return [[m.value for m in derive.apply([metric])] for metric in metrics]
+
+
+def test_rate_per_second():
+    assert rates(counter(0, 100), counter(10, 600)) == [[], [50]]
+
+
+def test_int_counters_give_int_rates():
+    (rate,) = rates(counter(0, 0), counter(3, 10))[1]
+    assert rate == 3 and isinstance(rate, int)
+    assert rates(counter(0, 0.0), counter(4, 1.0))[1] == [0.25]
+
+
+def test_wrap_of_32_bit_counter():
+    assert rates(counter(0, WRAP_32 - 100), counter(10, 100)) == [[], [20]]
+
+
+def test_reset_counts_from_zero():
+    assert rates(counter(0, 2**40), counter(10, 500)) == [[], [50]]
+
+
+def test_new_epoch_only_sets_the_state():
+    assert rates(
+        counter(0, 1000), counter(10, 10, "reboot"), counter(20, 110, "reboot")
+    ) == [[], [], [10]]
+
+
+def test_out_of_order_is_dropped():
+    assert rates(counter(10, 100), counter(10, 200), counter(5, 300)) == [[], [], []]
+
+
+def test_other_metrics_pass_through():
+    metric = Metric(tag="cpu_load_1", time=0, value=0.5)
+    assert Derive().apply([metric]) == [metric]
@@ -0,0 +1,35 @@
+from wiretap.lineprotocol import encode, split_tag
+from wiretap.schemas import Metric
+
+
+def metric(**kwargs) -> Metric:
+    return Metric(
+        **{"tag": "cpu_usage", "time": 1, "value": 1, "name": "web1", **kwargs}
+    )
+
+
+def test_split_tag():
+    assert split_tag("cpu_load_1") == ("cpu", "load_1")
+    assert split_tag("uptime") == ("uptime", "uptime")
+
+
+def test_values():
+    assert encode(metric(value=3)) == b"cpu,agg_type=mean,name=web1 usage=3i 1"
+    assert encode(metric(value=0.5)).endswith(b" usage=0.5 1")
+    assert encode(metric(value=True)).endswith(b" usage=true 1")
+    assert encode(metric(value='say "hi" \\')).endswith(b' usage="say \\"hi\\" \\\\" 1')
+
+
+def test_escaping():
+    line = encode(metric(tag="my cpu,x_a=b c", name="web 1,eu=x"))
+    assert line == b"my\\ cpu\\,x,agg_type=mean,name=web\\ 1\\,eu\\=x a\\=b\\ c=1i 1"
+
+
+def test_window_tag():
+    assert encode(metric(), "5m") == b"cpu,agg_type=mean,name=web1,window=5m usage=1i 1"
+
+
+def test_no_finite_value():
+    assert encode(metric(value=None)) is None
+    assert encode(metric(value=float("nan"))) is None
+    assert encode(metric(value=float("inf"))) is None
@@ -0,0 +1,27 @@
+import asyncio
+
+from wiretap.ping import _checksum, _echo_request, _response, ping_many
+
+
+def test_echo_request_checksum():
+    assert _checksum(_echo_request(7)) == 0
+
+
+def test_response():
+    response = _response(4, [1.0, 3.0, 2.0])
+    assert response.packet_loss == 25
+    assert (response.rtt_min, response.rtt_avg, response.rtt_max) == (1.0, 2.0, 3.0)
+    assert response.jitter == 1.5
+    assert _response(3, []).packet_loss == 100
+
+
+def test_ping_localhost():
+    response = asyncio.run(ping_many(["127.0.0.1"], count=2, interval=0.01))
+    assert response["127.0.0.1"].packet_loss == 0
+    assert response["127.0.0.1"].rtt_min >= 0
+
+
+def test_unresolvable_host():
+    host = "wiretap.invalid"
+    response = asyncio.run(ping_many([host], count=1, interval=0.01, timeout=0.5))
+    assert response[host].packet_loss == 100
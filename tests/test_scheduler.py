@@ -0,0 +1,40 @@
+from wiretap.scheduler import Scheduler
+
+
+def scheduler(overrun: str) -> Scheduler:
+    scheduler = Scheduler(jitter=0, overrun=overrun, late_after=1, max_catchup=2)
+    scheduler.add("job", 10)
+    return scheduler
+
+
+def test_due_on_time():
+    s = scheduler("skip")
+    deadline = s.heap[0][0]
+    assert s.pop_due(deadline - 1) == []
+    assert s.pop_due(deadline) == ["job"]
+    assert s.heap[0][0] == deadline + 10
+    assert s.stats["job"] == {"runs": 1, "missed": 0, "late": 0}
+
+
+def test_skip_drops_the_passed_runs():
+    s = scheduler("skip")
+    deadline = s.heap[0][0]
+    assert s.pop_due(deadline + 35) == ["job"]
+    assert s.heap[0][0] == deadline + 40
+    assert s.stats["job"] == {"runs": 1, "missed": 3, "late": 1}
+
+
+def test_catchup_runs_up_to_max_catchup():
+    s = scheduler("catchup")
+    deadline = s.heap[0][0]
+    now = deadline + 35
+    assert s.pop_due(now) == ["job"]
+    assert s.stats["job"]["missed"] == 1
+    assert s.pop_due(now) == ["job"]
+    assert s.pop_due(now) == ["job"]
+    assert s.pop_due(now) == []
+    assert s.heap[0][0] == deadline + 40
+
+
+def test_nothing_scheduled():
+    assert Scheduler().pop_due() == []
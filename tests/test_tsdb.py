@@ -0,0 +1,42 @@
+import math
+import random
+
+from wiretap.tsdb import Chunk, decode, _glob
+
+
+def roundtrip(points: list) -> list:
+    (start, value), *rest = points
+    chunk = Chunk(start, value)
+    for timestamp, value in rest:
+        chunk.append(timestamp, value)
+    return list(decode(chunk.start, chunk.count, chunk.data()))
+
+
+def test_regular_points():
+    points = [(1000 + 60 * i, float(i % 3)) for i in range(100)]
+    assert roundtrip(points) == points
+
+
+def test_irregular_points():
+    rng = random.Random(1)
+    timestamp, points = 0, []
+    for _ in range(500):
+        timestamp += rng.choice([0, 1, 59, 60, 61, 3000, 10**6])
+        points.append((timestamp, rng.choice([0.0, -1.5, 1e300, rng.random()])))
+    assert roundtrip(points) == points
+
+
+def test_single_point():
+    assert roundtrip([(5, 2.5)]) == [(5, 2.5)]
+
+
+def test_special_values():
+    points = roundtrip([(0, math.inf), (1, -0.0), (2, math.nan)])
+    assert points[0] == (0, math.inf)
+    assert math.copysign(1, points[1][1]) == -1
+    assert math.isnan(points[2][1])
+
+
+def test_glob_has_only_star_as_wildcard():
+    assert _glob("disk_*") == "disk_*"
+    assert _glob("a?[b]") == "a[?][[]b]"
@@ -1,13 +1,18 @@
 import json
+import time
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 
-from wiretap.utils import read_config, read_inventory, read_reverse_order, filestats
-from wiretap.config import settings
+from wiretap.utils import read_config, read_inventory
+from wiretap.metriclog import MetricLog
+from wiretap.latest import read_latest, read_last_seen
+from wiretap.stats import read_stats
+from wiretap import tsdb
 
 app = FastAPI()
+metric_log = MetricLog()
 app.mount("/static", StaticFiles(directory="web/static"), name="static")
 
 
@@ -19,31 +24,33 @@ def serve_front():
 
 @app.get("/api/inventory")
 def serve_inventory():
+    last_rtt = {x["name"]: x["time"] for x in read_latest(tag="health_rtt")}
+    last_seen = read_last_seen()
+
     inventory = []
-    temp = read_inventory()
-    for item in temp:
+    for item in read_inventory():
         item = dict(item)
-        item["timestamp"] = 0
+        item["timestamp"] = last_rtt.get(item["name"], 0)
+        item["last_seen"] = last_seen.get(item["name"], 0)
         inventory.append(item)
+    return inventory
 
-    for n, line in enumerate(read_reverse_order(settings.metric_file)):
-        if line:
-            line = json.loads(line)
-            if line.get("tag") == "health_rtt":
-                for server in inventory:
-                    if server.get("name") == line.get("name"):
-                        if line.get("time") > server["timestamp"]:
-                            server["timestamp"] = line.get("time")
-                            break
-        if n > 1000 or all(x.get("timestamp") > 0 for x in inventory):
-            break
 
-    return inventory
+@app.get("/api/status")
+def serve_status(name: str = None):
+    status = {}
+    for x in read_latest(name=name):
+        status.setdefault(x["name"], {})[x["tag"]] = {
+            "time": x["time"],
+            "value": x["value"],
+            "unit": x["unit"],
+        }
+    return status
 
 
 @app.get("/api/metrics")
 def serve_metrics():
-    for n, line in enumerate(read_reverse_order(settings.metric_file)):
+    for n, line in enumerate(metric_log.read_reverse()):
         if n <= 100:
             try:
                 yield json.loads(line)
@@ -53,6 +60,18 @@ def serve_metrics():
             break
 
 
+@app.get("/api/series")
+def serve_series(name: str = None, tag: str = None):
+    return tsdb.list_series(name=name, tag=tag)
+
+
+@app.get("/api/query")
+def serve_query(start: int = None, end: int = None, name: str = None, tag: str = None):
+    end = end or int(time.time())
+    start = start or end - 3600
+    return tsdb.query(start, end, name=name, tag=tag)
+
+
 @app.get("/api/config")
 def serve_config():
     return read_config()
@@ -60,8 +79,9 @@ def serve_config():
 
 @app.get("/api/stats")
 def serve_stats():
-    linecount, filesize = map(int, filestats(settings.metric_file))
+    stats = read_stats()
     return {
-        "metrics_size": filesize,
-        "metrics_count": "{:,}".format(linecount).replace(",", " "),
+        **stats,
+        "metrics_size": stats.get("bytes", 0),
+        "metrics_count": "{:,}".format(stats.get("points", 0)).replace(",", " "),
     }
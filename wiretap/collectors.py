@@ -1,15 +1,92 @@
 import re
 import json
 import time
-import datetime
-from pydantic import ValidationError
+import shlex
+import fnmatch
+import logging
+from array import array
+from typing import List
+from pydantic import ValidationError, parse_obj_as
 
 from wiretap.schemas import Metric
 from wiretap.utils import keyvalue_set, keyvalue_get
 from wiretap import schemas
 
+log = logging.getLogger()
 
-def journalctl(config=None):
+
+class JournalRules:
+    """The journalctl rules of a config, compiled once
+
+    *prefilter* is one extended regex for egrep on the remote matching any rule, the
+    first regex of a rule is only used there, on the raw json record, as before.
+    *match* dispatches a message to the rules whose extract regex accepts it.
+    """
+
+    def __init__(self, rules: list):
+        self.rules = []
+        for rule in rules or []:
+            _, extract_re = rule.get("regex")
+            self.rules.append((re.compile(extract_re), rule))
+        self.prefilter = "|".join(f"({rule.get('regex')[0]})" for rule in rules or [])
+
+    def match(self, message: str):
+        """Yields the rule and extracted groups for every rule matching *message*"""
+        for extract_re, rule in self.rules:
+            if m := extract_re.match(message):
+                yield rule, m.groupdict()
+
+
+def prepare(config: dict) -> dict:
+    """Validates the rules in *config* and precomputes what the collectors need from it
+
+    Runs once per config load, so collectors can trust the rules they are given.
+    """
+    for legacy in ["cpu", "memory", "network"]:
+        if legacy in config:
+            log.error(
+                f'The "{legacy}" collector is part of "proc" now, move its config there'
+            )
+    if journal := config.get("journalctl"):
+        journal["rules"] = [
+            rule.dict()
+            for rule in parse_obj_as(
+                List[schemas.JournalRule], journal.get("rules") or []
+            )
+        ]
+        journal["matcher"] = JournalRules(journal.get("rules"))
+    if nginx := config.get("nginx"):
+        nginx["groups"] = [
+            group.dict()
+            for group in parse_obj_as(List[schemas.UrlGroup], nginx.get("groups") or [])
+        ]
+        nginx["matchers"] = [
+            (group["tag"], re.compile(group["regex"])) for group in nginx["groups"]
+        ]
+    if files := config.get("files"):
+        files["rules"] = [
+            rule.dict()
+            for rule in parse_obj_as(List[schemas.FileRule], files.get("rules") or [])
+        ]
+        files["shared"] = [rule for rule in files["rules"] if not rule["hosts"]]
+        files["by_host"] = {}
+        for rule in files["rules"]:
+            for host in rule["hosts"] or []:
+                files["by_host"].setdefault(host, []).append(rule)
+    return config
+
+
+def journalctl(config=None, follow=False):
+    """Extracts metrics from journal records with the rules of the config
+
+    With *follow* the journal is kept open with journalctl -f, the aggregator then
+    handles records as they arrive and saves the cursor every *checkpoint_interval*
+    seconds instead of once at the end.
+    """
+
+    matcher = config.get("matcher") or JournalRules(config.get("rules"))
+    if not matcher.rules:
+        return
 
     command = 'journalctl -o json --no-pager --output-fields="MESSAGE,_TRANSPORT,_HOSTNAME,_BOOT_ID"'
     cursor = keyvalue_get(f"journal_cursor_{config.get('name')}")
@@ -17,23 +94,25 @@ def journalctl(config=None):
         command = f'{command} --after-cursor="{cursor}"'
     else:
         command = f"{command} -S today"
-    commands = []
-    for p in config.get("rules"):
-        match_re, extract_re = p.get("regex")
-        commands.append(command + f""" | egrep "{match_re}" """)
+    if follow:
+        command += f""" -f | egrep --line-buffered "{matcher.prefilter}" """
+    else:
+        command += f""" | egrep "{matcher.prefilter}" """
+    checkpoint_interval = int(config.get("checkpoint_interval", 10))
 
     def run(x, config=None):
-        x = list(x)
-        log_records = []
+        keyname = f"boot_id_{config.get('name')}"
+        bootid = keyvalue_get(keyname)
+        cursor = None
+        checkpoint = time.monotonic() + checkpoint_interval
         for record in x:
             try:
-                log_records.append(schemas.LogRecord(**json.loads(record)))
-            except ValidationError:
+                line = schemas.LogRecord(**json.loads(record))
+            except (ValidationError, json.JSONDecodeError):
                 print(f"Could not validate {record}")
+                continue
+            cursor = line.cursor
 
-        keyname = f"boot_id_{config.get('name')}"
-        bootid = keyvalue_get(keyname)
-        for line in log_records:
             timestamp = int(str(line.timestamp)[:-6])
             """
             if bootid != line.boot_id:
@@ -43,198 +122,22 @@ def journalctl(config=None):
                 bootid = keyvalue_get(keyname)
             """
 
-            if config.get("rules"):
-                for rule in config.get("rules"):
-                    match_re, extract_re = rule.get("regex")
-                    m = re.match(extract_re, line.message)
-                    if m:
-                        if m := m.groupdict():
-                            metric = Metric(
-                                tag=rule.get("tag"),
-                                agg_type=rule.get("agg_type"),
-                                value=1,
-                                time=timestamp,
-                            )
-                            if tag := m.get("tag"):
-                                metric.tag = tag
-                            if name := m.get("name"):
-                                metric.name = name
-                            if value := m.get("value"):
-                                metric.value = value
-                            yield metric
-
-        if log_records:
-            keyvalue_set(f"journal_cursor_{config.get('name')}", log_records[-1].cursor)
-
-    for cmd in commands:
-        yield cmd, run
-
-
-def network(config=None):
-
-    command = r"date +%s && ip -s link"
-
-    def run(x, config=None):
-        timestamp = next(x)
-        result = list(x)
-        number_of_nics = int(result[-6].split(":")[0])
-        for i in range(number_of_nics):
-            pos = i * 6
-            try:
-                nic_name = result[pos].split(":")[1].strip().lower()
-                if nic_name == "lo":
-                    continue
-                rx_line = result[pos + 3]
-                tx_line = result[pos + 5]
-                rx, packets, errors, dropped, overrun, mcast = map(
-                    lambda x: int(x) // int(config.get("interval", 60)),
-                    re.match(
-                        "\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)", rx_line
-                    ).groups(),
-                )
-                if rx > 0:
-                    yield Metric(
-                        tag=f"network_{nic_name}_rx_bytes",
-                        time=timestamp,
-                        value=rx,
-                        unit="bytes",
-                        agg_type="count",
-                    )
-                    yield Metric(
-                        tag=f"network_{nic_name}_rx_packets",
-                        time=timestamp,
-                        value=packets,
-                        unit="packets",
-                        agg_type="count",
-                    )
-                    yield Metric(
-                        tag=f"network_{nic_name}_rx_errors",
-                        time=timestamp,
-                        value=errors,
-                        unit="errors",
-                        agg_type="count",
-                    )
-                    yield Metric(
-                        tag=f"network_{nic_name}_rx_dropped",
-                        time=timestamp,
-                        value=dropped,
-                        unit="packets",
-                        agg_type="count",
-                    )
-
-                tx, packets, errors, dropped, carrier, collsns = map(
-                    lambda x: int(x) // int(config.get("interval", 60)),
-                    re.match(
-                        "\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)", tx_line
-                    ).groups(),
-                )
-                if tx > 0:
-                    yield Metric(
-                        tag=f"network_{nic_name}_tx_bytes",
-                        time=timestamp,
-                        value=tx,
-                        unit="bytes",
-                        agg_type="count",
-                    )
-                    yield Metric(
-                        tag=f"network_{nic_name}_tx_packets",
-                        time=timestamp,
-                        value=packets,
-                        unit="packets",
-                        agg_type="count",
-                    )
+            for rule, m in matcher.match(line.message):
+                if m:
                     yield Metric(
-                        tag=f"network_{nic_name}_tx_errors",
+                        tag=m.get("tag") or rule.get("tag"),
+                        agg_type=rule.get("agg_type"),
+                        value=m.get("value") or 1,
                         time=timestamp,
-                        value=errors,
-                        unit="errors",
-                        agg_type="count",
+                        name=m.get("name"),
                     )
-                    yield Metric(
-                        tag=f"network_{nic_name}_tx_dropped",
-                        time=timestamp,
-                        value=dropped,
-                        unit="packets",
-                        agg_type="count",
-                    )
-            except IndexError:
-                pass
-
-    yield command, run
 
+            if follow and time.monotonic() >= checkpoint:
+                keyvalue_set(f"journal_cursor_{config.get('name')}", cursor)
+                checkpoint = time.monotonic() + checkpoint_interval
 
-def cpu(config=None):
-    command = r"date +%s && lscpu && uptime"
-
-    def run(x, config=None):
-        timestamp = next(x)
-        cpus = 0
-        for line in x:
-            if line.startswith("CPU(s):"):
-                cpus = int(line[-4:])
-        cpu_averages = map(
-            float, line.split("load average: ")[1].replace(",", ".").split(". ")
-        )
-        avg_1, avg_5, avg_15 = map(
-            lambda y: round(y / cpus, 2), cpu_averages
-        )  # Normalize to # of cores
-        try:
-            assert 0 <= avg_1 <= 1
-        except AssertionError:
-            return []
-        yield from [
-            Metric(tag="cpu_usage", time=timestamp, value=avg_1, unit="%"),
-            Metric(tag="cpu_free", time=timestamp, value=round(1 - avg_1, 4), unit="%"),
-            Metric(tag="cpu_cores", time=timestamp, value=cpus, unit="cores"),
-            Metric(
-                tag="health_timestamp",
-                time=timestamp,
-                value=timestamp,
-                unit="timestamp",
-            ),
-        ]
-
-    yield command, run
-
-
-def memory(config=None):
-    command = r"date +%s && free -m"
-
-    def run(x, config):
-        timestamp = next(x)
-        for line in x:
-            line = line.strip()
-            if line.startswith("Mem:"):
-                total, used, free, shared, buffcached, avail = map(
-                    float,
-                    re.match(
-                        r"^Mem:\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)", line
-                    ).groups(),
-                )
-                yield from [
-                    Metric(
-                        tag="memory_available", time=timestamp, value=avail, unit="MiB"
-                    ),
-                    Metric(tag="memory_used", time=timestamp, value=used, unit="MiB"),
-                    Metric(tag="memory_total", time=timestamp, value=total, unit="MiB"),
-                    Metric(
-                        tag="memory_free",
-                        time=timestamp,
-                        value=total - used,
-                        unit="MiB",
-                    ),
-                ]
-            if line.startswith("Swap:"):
-                total, used, free = map(
-                    float, re.match(r"^Swap:\s+(\d+)\s+(\d+)\s+(\d+)", line).groups()
-                )
-                yield from [
-                    Metric(tag="swap_used", time=timestamp, value=used, unit="MiB"),
-                    Metric(tag="swap_total", time=timestamp, value=total, unit="MiB"),
-                    Metric(
-                        tag="swap_free", time=timestamp, value=total - used, unit="MiB"
-                    ),
-                ]
+        if cursor:
+            keyvalue_set(f"journal_cursor_{config.get('name')}", cursor)
 
     yield command, run
 
@@ -268,58 +171,532 @@ def disk(config=None):
     yield command, run
 
 
-def files(config=None):
+PROC_FILES = [
+    "/proc/stat",
+    "/proc/meminfo",
+    "/proc/net/dev",
+    "/proc/diskstats",
+    "/proc/loadavg",
+    "/proc/sys/kernel/random/boot_id",
+]
 
-    command = r"date +%s"
-    if rules := config.get("rules"):
-        for rule in rules:
-            if rule.get("hosts"):
-                if config.get("name") not in rule.get("hosts"):
-                    continue
-            command += f" && echo '{rule.get('tag')}'; ls {rule.get('path')} | wc -l"
+
+def proc(config=None):
+    """Bundle of the cpu, memory, network and disk activity collectors
+
+    Reads all the /proc files in one process, tail prints a header before each file
+    which splits the output back into sections. The network and disk counters are
+    marked with the boot id, so reboots are not taken for traffic.
+    """
+
+    command = r"date +%s && tail -n +1 " + " ".join(PROC_FILES)
 
     def run(x, config=None):
-        timestamp = next(x)
-        for tag, count in zip(*[x] * 2):  # Sjukt
-            metric = Metric(
-                tag=tag, agg_type="mean", unit="files", value=int(count), time=timestamp
+        timestamp = int(next(x))
+        sections = {name: [] for name in PROC_FILES}
+        section = None
+        for line in x:
+            if line.startswith("==> "):
+                section = sections.get(line[4:-4])
+            elif line and section is not None:
+                section.append(line)
+
+        boot_id = next(iter(sections["/proc/sys/kernel/random/boot_id"]), True)
+        avg_1, avg_5, avg_15 = map(float, sections["/proc/loadavg"][0].split()[:3])
+        yield from [
+            Metric(tag="cpu_load_1", time=timestamp, value=avg_1, unit="load"),
+            Metric(tag="cpu_load_5", time=timestamp, value=avg_5, unit="load"),
+            Metric(tag="cpu_load_15", time=timestamp, value=avg_15, unit="load"),
+            Metric(
+                tag="health_timestamp",
+                time=timestamp,
+                value=timestamp,
+                unit="timestamp",
+            ),
+        ]
+        yield from cpu_usage.parse(sections["/proc/stat"], timestamp, config)
+
+        meminfo = {}
+        for line in sections["/proc/meminfo"]:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0]) / 1024  # kB to MiB
+        total = meminfo["MemTotal"]
+        used = total - sum(
+            meminfo.get(key, 0)
+            for key in ["MemFree", "Buffers", "Cached", "SReclaimable"]
+        )
+        yield from [
+            Metric(
+                tag="memory_available",
+                time=timestamp,
+                value=meminfo.get("MemAvailable", meminfo["MemFree"]),
+                unit="MiB",
+            ),
+            Metric(tag="memory_used", time=timestamp, value=used, unit="MiB"),
+            Metric(tag="memory_total", time=timestamp, value=total, unit="MiB"),
+            Metric(tag="memory_free", time=timestamp, value=total - used, unit="MiB"),
+            Metric(
+                tag="swap_used",
+                time=timestamp,
+                value=meminfo["SwapTotal"] - meminfo["SwapFree"],
+                unit="MiB",
+            ),
+            Metric(
+                tag="swap_total", time=timestamp, value=meminfo["SwapTotal"], unit="MiB"
+            ),
+            Metric(
+                tag="swap_free", time=timestamp, value=meminfo["SwapFree"], unit="MiB"
+            ),
+        ]
+
+        for line in sections["/proc/net/dev"][2:]:
+            nic_name, counters = line.split(":", 1)
+            nic_name = nic_name.strip().lower()
+            if nic_name == "lo":
+                continue
+            counters = [int(c) for c in counters.split()]
+            for direction, offset in [("rx", 0), ("tx", 8)]:
+                nbytes, packets, errors, dropped = counters[offset : offset + 4]
+                if nbytes > 0:
+                    yield from [
+                        Metric(
+                            tag=f"network_{nic_name}_{direction}_{field}",
+                            time=timestamp,
+                            value=value,
+                            unit=f"{unit}/s",
+                            counter=boot_id,
+                        )
+                        for field, value, unit in [
+                            ("bytes", nbytes, "bytes"),
+                            ("packets", packets, "packets"),
+                            ("errors", errors, "errors"),
+                            ("dropped", dropped, "packets"),
+                        ]
+                    ]
+
+        yield from disk_activity.parse(
+            sections["/proc/diskstats"], timestamp, config, boot_id
+        )
+
+    yield command, run
+
+
+NGINX_LINE = re.compile(
+    r'\S+ \S+ \S+ \[[^\]]*\] "(?:[A-Z]+ )?(?P<url>[^ "]*)[^"]*" (?P<status>\d{3})'
+    r' (?P<bytes>\d+|-)(?: "[^"]*" "[^"]*")?(?: (?:rt=)?(?P<request_time>\d+\.?\d*))?'
+)
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def nginx(config=None):
+    """Request counts, bytes and latency from the lines added to an nginx access log
+
+    Only the bytes added since the last run are read, from the inode and offset
+    saved per host, at most *max_bytes* per run and only up to the last complete
+    line, so no line is split between runs. When the inode changed the log was
+    rotated, and the rest of the rotated file (path.1) is read before the new one is
+    started. A log shorter than the offset was truncated and is read from the start.
+    The first run only saves the offset. The lines are counted per status class,
+    per url group of the config and per latency bucket (when the log format ends with $request_time), and one set
+    of count metrics is yielded per run.
+    """
+
+    if not (path := config.get("path")):
+        return
+
+    key = f"nginx_offset_{config.get('name')}_{path}"
+    inode, offset = keyvalue_get(key) or ["", 0]
+    max_bytes = int(config.get("max_bytes", 50 * 1024**2))
+    quoted = shlex.quote(path)
+    rotated = shlex.quote(path + ".1")
+    command = (
+        f"date +%s && if I=$(stat -Lc %i {quoted} 2>/dev/null); then"
+        f" F={quoted}; S=$(stat -Lc %s {quoted}); O={int(offset)}; L=1;"
+        f' if [ "$I" != "{inode}" ]; then'
+        f' if [ -z "{inode}" ]; then O=$S;'
+        f' elif [ "$(stat -Lc %i {rotated} 2>/dev/null)" = "{inode}" ]'
+        f' && [ "$(stat -Lc %s {rotated})" -gt "$O" ]; then'
+        f" I={inode}; F={rotated}; S=$(stat -Lc %s {rotated}); L=;"
+        f" else O=0; fi; fi;"
+        f' if [ "$S" -lt "$O" ]; then O=0; fi;'
+        f" E=$(( S - O > {max_bytes} ? O + {max_bytes} : S ));"
+        f' if [ -n "$L" ] || [ "$E" -lt "$S" ]; then'
+        f' P=$({{ tail -c +$(( O + 1 )) "$F" | head -c $(( E - O )); echo; }}'
+        f" | tail -n 1 | wc -c);"
+        f' if [ $(( E - P + 1 )) -gt "$O" ] || [ "$E" -eq "$S" ]; then'
+        f" E=$(( E - P + 1 )); fi; fi;"
+        f' echo "$I $E";'
+        f' tail -c +$(( O + 1 )) "$F" | head -c $(( E - O )); fi'
+    )
+
+    def run(x, config=None):
+        timestamp = int(next(x))
+        if not (header := next(x, None)):
+            return  # No log
+
+        matchers = config.get("matchers") or [
+            (group["tag"], re.compile(group["regex"]))
+            for group in config.get("groups") or []
+        ]
+        buckets = config.get("latency_buckets") or LATENCY_BUCKETS
+        requests, sent, latency_count = 0, 0, 0
+        statuses = [0] * 6
+        groups = [0] * len(matchers)
+        latencies = [0] * len(buckets)
+        match = NGINX_LINE.match
+        for line in x:
+            if not (m := match(line)):
+                continue
+            requests += 1
+            statuses[int(m["status"][0]) % 6] += 1
+            if m["bytes"] != "-":
+                sent += int(m["bytes"])
+            url = m["url"]
+            for i, (_, regex) in enumerate(matchers):
+                if regex.match(url):
+                    groups[i] += 1
+                    break
+            if (request_time := m["request_time"]) is not None:
+                latency_count += 1
+                milliseconds = float(request_time) * 1000
+                for i, bound in enumerate(buckets):
+                    if milliseconds <= bound:
+                        latencies[i] += 1
+        keyvalue_set(key, [header.split()[0], int(header.split()[1])])
+
+        yield from [
+            Metric(
+                tag="nginx_requests",
+                time=timestamp,
+                value=requests,
+                unit="requests",
+                agg_type="count",
+            ),
+            Metric(
+                tag="nginx_bytes_sent",
+                time=timestamp,
+                value=sent,
+                unit="bytes",
+                agg_type="count",
+            ),
+        ]
+        yield from [
+            Metric(
+                tag=f"nginx_status_{n}xx",
+                time=timestamp,
+                value=count,
+                unit="requests",
+                agg_type="count",
+            )
+            for n, count in enumerate(statuses)
+            if count
+        ]
+        yield from [
+            Metric(
+                tag=f"nginx_group_{tag}",
+                time=timestamp,
+                value=count,
+                unit="requests",
+                agg_type="count",
+            )
+            for (tag, _), count in zip(matchers, groups)
+            if count
+        ]
+        if latency_count:
+            yield from [
+                Metric(
+                    tag=f"nginx_latency_{bound}ms",
+                    time=timestamp,
+                    value=count,
+                    unit="requests",
+                    agg_type="count",
+                )
+                for bound, count in zip(buckets, latencies)
+            ]
+            yield Metric(
+                tag="nginx_latency_count",
+                time=timestamp,
+                value=latency_count,
+                unit="requests",
+                agg_type="count",
             )
-            yield metric
 
     yield command, run
 
 
-class Logs:
-    @staticmethod
-    def command(config=None):
-        return r"cat /var/log/nginx/access.log"
+_files_last = {}
+
+
+def files(config=None):
+    """Count, bytes and newest and oldest mtime of the entries of each rule path
+
+    All paths of the rules for the host go to one find, printing the depth, type,
+    size, mtime and whether it is hidden of the path and every entry directly in
+    it, followed by the start path it was found from, which is matched back to the
+    rules (globs and a leading ~/ are expanded by the shell, globs are matched with
+    fnmatch and ~ with the home directory printed before, the rest of a path is
+    quoted). Symlinks given as paths are followed. Entries are never printed by
+    name, so no file name can break the format. Like ls, hidden entries are not
+    counted, and the bytes are those of the regular files. Growth is the change of
+    the bytes since the last run on the host.
+    """
+
+    rules = files_rules(config)
+    if not rules:
+        return
+
+    paths = list(dict.fromkeys(rule["path"] for rule in rules))
+    command = (
+        r"date +%s && echo ~ && find -H "
+        + " ".join(map(_files_quote, paths))
+        + r" -maxdepth 1 \( -name '.*' -printf '%d %y %s %T@ h %H\n'"
+        + r" -o -printf '%d %y %s %T@ - %H\n' \) 2>/dev/null"
+    )
 
-    @staticmethod
     def run(x, config=None):
-        lineformat = re.compile(
-            r"""(?P<ipaddress>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}) - - \[(?P<dateandtime>\d{2}\/[a-z]{3}\/\d{4}:\d{2}:\d{2}:\d{2} (\+|\-)\d{4})\] ((\"(?P<method>[A-Z]+) )(?P<url>.+)(http\/1\.1")) (?P<statuscode>\d{3}) (?P<bytessent>\d+) (?P<refferer>-|"([^"]+)") (["](?P<useragent>[^"]+)["])""",
-            re.IGNORECASE,
-        )
+        timestamp = int(next(x))
+        home = next(x)
+        stats = {path: [0, 0, None, None] for path in paths}
+        starts = {}
         for line in x:
-            if m := re.search(lineformat, line):
-                if m := m.groupdict():
-                    timestamp = int(
-                        datetime.datetime.strptime(
-                            m.get("dateandtime"), "%d/%b/%Y:%H:%M:%S %z"
-                        ).timestamp()
-                    )
-                    yield Metric(
-                        tag="pageview_" + m.get("url"),
+            try:
+                depth, kind, size, mtime, hidden, start = line.split(" ", 5)
+            except ValueError:
+                continue
+            if depth == "0" and kind == "d":
+                continue  # The directory itself
+            if depth != "0" and hidden == "h":
+                continue
+            if (path := starts.get(start)) is None:
+                path = starts[start] = _files_path(start, paths, home)
+            if path is None:
+                continue
+            entry = stats[path]
+            mtime = int(float(mtime))
+            entry[0] += 1
+            if kind == "f":
+                entry[1] += int(size)
+            entry[2] = mtime if entry[2] is None else max(entry[2], mtime)
+            entry[3] = mtime if entry[3] is None else min(entry[3], mtime)
+
+        host = config.get("name")
+        for rule in rules:
+            tag, agg_type = rule["tag"], rule.get("agg_type") or "mean"
+            count, size, newest, oldest = stats[rule["path"]]
+            yield from [
+                Metric(
+                    tag=tag,
+                    time=timestamp,
+                    value=count,
+                    unit="files",
+                    agg_type=agg_type,
+                ),
+                Metric(
+                    tag=f"{tag}_bytes",
+                    time=timestamp,
+                    value=size,
+                    unit="bytes",
+                    agg_type=agg_type,
+                ),
+            ]
+            if newest is not None:
+                yield from [
+                    Metric(
+                        tag=f"{tag}_newest",
                         time=timestamp,
-                        value=1,
-                        unit="page",
-                    )
+                        value=newest,
+                        unit="timestamp",
+                        agg_type="nop",
+                    ),
+                    Metric(
+                        tag=f"{tag}_oldest",
+                        time=timestamp,
+                        value=oldest,
+                        unit="timestamp",
+                        agg_type="nop",
+                    ),
+                ]
+            if (last := _files_last.get((host, tag))) is not None:
+                yield Metric(
+                    tag=f"{tag}_growth",
+                    time=timestamp,
+                    value=size - last,
+                    unit="bytes",
+                    agg_type="count",
+                )
+            _files_last[host, tag] = size
+
+    yield command, run
+
+
+def files_rules(config: dict) -> list:
+    """The rules of the files config applying to the host in *config*"""
+    if "shared" in config:
+        return config["shared"] + config["by_host"].get(config.get("name"), [])
+    return [
+        rule
+        for rule in config.get("rules") or []
+        if not rule.get("hosts") or config.get("name") in rule.get("hosts")
+    ]
+
+
+FILES_GLOB = re.compile(r"(\*|\?|\[[\w.!^-]+\])")
+
+
+def _files_quote(path: str) -> str:
+    """Quotes *path* for the shell, leaving only a leading ~/ and its glob patterns"""
+    tilde = "~/" if path.startswith("~/") else ""
+    return tilde + "".join(
+        part if n % 2 else shlex.quote(part) if part else ""
+        for n, part in enumerate(FILES_GLOB.split(path[len(tilde) :]))
+    )
+
+
+def _files_path(start: str, paths: list, home: str = "~"):
+    if start in paths:
+        return start
+    for path in paths:
+        if path.startswith("~/"):
+            expanded = home + path[1:]
+        else:
+            expanded = path
+        if start == expanded or fnmatch.fnmatchcase(start, expanded):
+            return path
 
 
 class DiskActivity:
-    # cat /proc/diskstats
-    # https://www.kernel.org/doc/Documentation/block/stat.txt
-    pass
+    """IOPS, throughput and utilization per block device, as counters of /proc/diskstats
+
+    https://www.kernel.org/doc/Documentation/block/stat.txt
+    The counters become per second rates in the engine, the time spent doing I/O is
+    given in seconds so its rate is the utilization.
+    Loop and ram devices and partitions are skipped, unless listed in "devices".
+    """
+
+    SECTOR_SIZE = 512
+
+    def command(self, config=None):
+        return r"date +%s && cat /proc/diskstats"
+
+    def run(self, x, config=None):
+        timestamp = int(next(x))
+        yield from self.parse(x, timestamp, config)
+
+    def parse(self, lines, timestamp: int, config: dict, boot_id=True):
+        devices = {}
+        for line in lines:
+            fields = line.split()
+            devices[fields[2]] = tuple(map(int, fields[3:14]))
+
+        wanted = config.get("devices") or [
+            name
+            for name in devices
+            if not name.startswith(("loop", "ram"))
+            and not self._is_partition(name, devices)
+        ]
+
+        for name in wanted:
+            if name not in devices:
+                continue
+            reads, _, read_sectors, _, writes, _, write_sectors, _, _, io_ms, _ = (
+                devices[name]
+            )
+            yield from [
+                Metric(
+                    tag=f"diskio_{name}_{field}",
+                    time=timestamp,
+                    value=value,
+                    unit=unit,
+                    counter=boot_id,
+                )
+                for field, value, unit in [
+                    ("read_iops", reads, "iops"),
+                    ("write_iops", writes, "iops"),
+                    ("read_bytes", read_sectors * self.SECTOR_SIZE, "bytes/s"),
+                    ("write_bytes", write_sectors * self.SECTOR_SIZE, "bytes/s"),
+                    ("utilization", io_ms / 1000, "%"),
+                ]
+            ]
+
+    @staticmethod
+    def _is_partition(name: str, devices: dict) -> bool:
+        return any(
+            name != other and re.fullmatch(rf"{re.escape(other)}p?\d+", name)
+            for other in devices
+        )
+
+
+disk_activity = DiskActivity()
+
+
+class CpuUsage:
+    """CPU utilization overall and per core, from deltas of /proc/stat
+
+    The jiffies of the last run are kept per host in one flat array, eight counters
+    (user nice system idle iowait irq softirq steal) per cpu line. Values are
+    fractions of the time between runs, the first run only sets the counters.
+    Set "per_core" to false to only report the totals.
+    """
+
+    FIELDS = 8
+
+    def __init__(self):
+        self.last = {}
+
+    def parse(self, lines, timestamp: int, config: dict):
+        names, counters = [], array("Q")
+        for line in lines:
+            if line.startswith("cpu"):
+                fields = line.split()
+                names.append(fields[0])
+                counters.extend(map(int, fields[1 : self.FIELDS + 1]))
+
+        yield Metric(
+            tag="cpu_cores", time=timestamp, value=len(names) - 1, unit="cores"
+        )
+
+        host = config.get("name")
+        last = self.last.get(host)
+        self.last[host] = counters
+        if last is None or len(last) != len(counters):
+            return
+
+        per_core = config.get("per_core", True)
+        for n, name in enumerate(names):
+            if n and not per_core:
+                break
+            pos = n * self.FIELDS
+            user, nice, system, idle, iowait, irq, softirq, steal = (
+                new - old
+                for new, old in zip(
+                    counters[pos : pos + self.FIELDS], last[pos : pos + self.FIELDS]
+                )
+            )
+            total = user + nice + system + idle + iowait + irq + softirq + steal
+            if total <= 0:
+                continue
+
+            prefix = "cpu" if name == "cpu" else f"cpu_core{name[3:]}"
+            values = [
+                ("usage", 1 - (idle + iowait) / total),
+                ("user", (user + nice) / total),
+                ("system", (system + irq + softirq) / total),
+                ("iowait", iowait / total),
+                ("steal", steal / total),
+                ("idle", idle / total),
+            ]
+            if name == "cpu":
+                values.append(("free", (idle + iowait) / total))
+            for field, value in values:
+                yield Metric(
+                    tag=f"{prefix}_{field}",
+                    time=timestamp,
+                    value=round(value, 4),
+                    unit="%",
+                )
+
+
+cpu_usage = CpuUsage()
 
 
 class Processes:
@@ -329,7 +706,7 @@ class Processes:
 
     @staticmethod
     def run(x, config=None):
-        timestamp = next(x)
+        timestamp = int(next(x))
         for line in x:
             if line.endswith(" nginx"):
                 yield Metric(
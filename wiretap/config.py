@@ -1,6 +1,7 @@
 from os import path
 from pydantic import BaseSettings, Field
 from pathlib import Path
+from typing import List
 
 
 class Settings(BaseSettings):
@@ -9,8 +10,13 @@ class Settings(BaseSettings):
     pkey_path: str = path.expanduser(key_path)
     config_file: str = str(Path(base_path, "config.json").absolute())
     inventory_file: str = str(Path(base_path, "inventory.json").absolute())
-    hash_file: str = str(Path(base_path, "hashes.json").absolute())
+    hash_dir: str = str(Path(base_path, "hashes").absolute())
     metric_file: str = str(Path(base_path, "metrics.jsonl").absolute())
+    segment_dir: str = str(Path(base_path, "metrics").absolute())
+    stats_file: str = str(Path(base_path, "stats.json").absolute())
+    tsdb_file: str = str(Path(base_path, "tsdb.db").absolute())
+    latest_file: str = str(Path(base_path, "latest.db").absolute())
+    keyvalue_file: str = str(Path(base_path, "keyvalue.log").absolute())
 
     INFLUX_TOKEN: str
     INFLUX_ORG: str
@@ -23,6 +29,133 @@ class Settings(BaseSettings):
     HEALTH_INTERVAL: int = Field(
         60, description="Approx. interval in seconds between health check"
     )
+    HEALTH_CONCURRENCY: int = Field(
+        50, description="Max number of health checks running at the same time"
+    )
+    HEALTH_DEADLINE: float = Field(
+        10.0, description="Seconds a single health check may take before it fails"
+    )
+    PING_COUNT: int = Field(3, description="Echo requests sent to each host per check")
+    PING_INTERVAL: float = Field(
+        0.2, description="Seconds between the echo requests to a host"
+    )
+    PING_TIMEOUT: float = Field(
+        2.0, description="Seconds to wait for replies after the last echo request"
+    )
+    PING_TCP_PORT: int = Field(
+        22, description="Port timed with TCP connects when ICMP is not available"
+    )
+    CERTIFICATE_REFRESH: int = Field(
+        86400, description="Seconds between checks of a host's certificate"
+    )
+    CERTIFICATE_EARLY_REFRESH: int = Field(
+        14 * 86400,
+        description="Check certificates expiring within this many seconds every retry",
+    )
+    CERTIFICATE_RETRY: int = Field(
+        3600,
+        description="Seconds between checks of failed or soon expiring certificates",
+    )
+
+    EXECUTION_MODE: str = Field(
+        "threads",
+        regex=r"^(threads|fleet)$",
+        description="threads: a thread per server, fleet: all remote servers in one thread",
+    )
+    FLEET_POOL_SIZE: int = Field(
+        100, description="Max number of hosts a fleet command runs on at once"
+    )
+    SSH_KEEPALIVE: int = Field(
+        60, description="Seconds between keepalive messages on idle ssh sessions"
+    )
+    SSH_TIMEOUT: float = Field(
+        10.0, description="Seconds to wait for an ssh connect or session operation"
+    )
+    SSH_READ_TIMEOUT: float = Field(
+        300.0,
+        description="Seconds to wait for more output of a collector command before giving up on the host",
+    )
+    SSH_BACKOFF_MIN: float = Field(
+        5.0, description="Seconds before the first reconnect after a failed connection"
+    )
+    SSH_BACKOFF_MAX: float = Field(
+        900.0, description="Max seconds between reconnects, doubling up from the min"
+    )
+    SCHEDULE_JITTER: float = Field(
+        1.0,
+        description="Part of a collector interval the first run is randomly delayed by, spreads load over the fleet",
+    )
+    SCHEDULE_OVERRUN: str = Field(
+        "skip",
+        description="What to do with runs missed by a late cycle, 'skip' or 'catchup'",
+    )
+    SCHEDULE_LATE_AFTER: float = Field(
+        5.0, description="Seconds after its deadline a run is counted as late"
+    )
+    SCHEDULE_MAX_CATCHUP: int = Field(
+        3, description="Max missed runs to catch up on with SCHEDULE_OVERRUN=catchup"
+    )
+
+    DEDUP_WINDOW: int = Field(
+        86400, description="Seconds a point is remembered to avoid storing it twice"
+    )
+    DEDUP_GENERATIONS: int = Field(
+        24, description="Number of pieces the dedup window is expired in"
+    )
+
+    KEYVALUE_FLUSH_INTERVAL: float = Field(
+        1.0, description="Seconds between writes of changed keys to the keyvalue log"
+    )
+
+    METRIC_SEGMENT_SIZE: int = Field(
+        32 * 1024 * 1024,
+        description="Bytes in the metric file before it is rotated to a compressed segment",
+    )
+    METRIC_SEGMENT_AGE: int = Field(
+        86400,
+        description="Seconds of metrics in the metric file before it is rotated",
+    )
+
+    TSDB_ENABLED: bool = Field(
+        True, description="Also store numeric metrics in the local time series store"
+    )
+    TSDB_CHUNK_POINTS: int = Field(
+        120, description="Points per compressed chunk in the local time series store"
+    )
+    TSDB_RETENTION: int = Field(
+        30 * 86400, description="Seconds of history kept in the local time series store"
+    )
+
+    ROLLUP_ENABLED: bool = Field(
+        True, description="Downsample metrics and write the rollups to ROLLUP_BUCKET"
+    )
+    ROLLUP_WINDOWS: List[str] = Field(
+        ["1m", "5m", "1h"], description="Rollup window lengths, in s, m, h or d"
+    )
+    ROLLUP_GRACE: int = Field(
+        60, description="Seconds after a window ends before it is flushed"
+    )
+    ROLLUP_BUCKET: str = Field(
+        "",
+        description="Bucket for rollups, defaults to INFLUX_BUCKET_PREFIX_downsampled",
+    )
+
+    WRITE_BATCH_SIZE: int = Field(
+        1000, description="Max number of points sent to InfluxDB in one request"
+    )
+    WRITE_FLUSH_INTERVAL: float = Field(
+        1.0, description="Max seconds a point waits in a batch before it is written"
+    )
+    WRITE_QUEUE_SIZE: int = Field(
+        5000, description="Max number of collector batches waiting to be written"
+    )
+    WRITE_WORKERS: int = Field(
+        2, description="Number of threads writing batches to InfluxDB"
+    )
+    WRITE_BLOCK_TIMEOUT: float = Field(
+        5.0,
+        description="Seconds a collector waits on a full write queue before the point is dropped, 0 drops at once",
+    )
 
     class Config:
         env_file = "wiretap.env"
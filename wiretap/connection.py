@@ -0,0 +1,122 @@
+import time
+import random
+import logging
+
+from pssh.clients import SSHClient
+from pssh.exceptions import (
+    AuthenticationError,
+    PKeyFileError,
+    ConnectionError as SSHConnectionError,
+    SessionError,
+    Timeout,
+    UnknownHostError,
+)
+from ssh2.exceptions import SSH2Error
+
+from wiretap.config import settings
+from wiretap.schemas import Server
+
+log = logging.getLogger()
+
+CONNECTION_ERRORS = (
+    AuthenticationError,
+    PKeyFileError,
+    SSHConnectionError,
+    SessionError,
+    Timeout,
+    UnknownHostError,
+    SSH2Error,
+    OSError,
+)
+
+
+class Connection:
+    """SSH session to one server, reused for every command and reconnected with backoff
+
+    The session is opened on first use and kept alive with ssh keepalives every
+    *keepalive* seconds, sent by a greenlet of pssh that runs whenever the thread
+    waits on gevent, as the Scheduler does between runs. Commands open new channels
+    on it. After *failed* the session is dropped, and *wait*
+    blocks until the next attempt: *backoff_min* seconds doubled for every failure
+    in a row, up to *backoff_max*, with up to half of it taken off at random so the
+    hosts on a flaky link do not reconnect in lockstep.
+    """
+
+    def __init__(
+        self,
+        server: Server,
+        keepalive: int = settings.SSH_KEEPALIVE,
+        timeout: float = settings.SSH_TIMEOUT,
+        backoff_min: float = settings.SSH_BACKOFF_MIN,
+        backoff_max: float = settings.SSH_BACKOFF_MAX,
+    ):
+        self.server = server
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._client = None
+        self.state = "disconnected"
+        self.failures = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.retry_at = 0.0
+
+    @property
+    def client(self) -> SSHClient:
+        if self._client is None:
+            self.state = "connecting"
+            self._client = SSHClient(
+                self.server.host,
+                user=self.server.username,
+                pkey=settings.pkey_path,
+                num_retries=1,
+                keepalive_seconds=self.keepalive,
+                timeout=self.timeout,
+            )
+            if self.connects:
+                self.reconnects += 1
+            self.connects += 1
+            self.state = "connected"
+        return self._client
+
+    def succeeded(self):
+        self.failures = 0
+
+    def failed(self, error: Exception):
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (self.failures - 1))
+        delay -= random.uniform(0, delay / 2)
+        self.retry_at = time.time() + delay
+        self.state = "backoff"
+        log.error(
+            f"Connection to {self.server.name} failed ({self.last_error}),"
+            f" retrying in {delay:.0f}s"
+        )
+        self.close()
+
+    def ready(self) -> bool:
+        return time.time() >= self.retry_at
+
+    def wait(self):
+        if (delay := self.retry_at - time.time()) > 0:
+            time.sleep(delay)
+
+    def close(self):
+        if self._client is not None:
+            try:
+                self._client.disconnect()
+            except Exception:
+                pass
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
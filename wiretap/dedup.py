@@ -0,0 +1,84 @@
+import time
+import threading
+
+from array import array
+from hashlib import blake2b
+from pathlib import Path
+
+from wiretap.config import settings
+
+
+class DedupIndex:
+    """Time windowed set of 64 bit digests, used to skip points that are already stored
+
+    The window is split in *generations*, each one kept as a set in memory and as an
+    append-only file of packed digests named after the generation number. Expired
+    generations are dropped from memory and deleted from disk as time moves on.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.hash_dir,
+        window: int = settings.DEDUP_WINDOW,
+        generations: int = settings.DEDUP_GENERATIONS,
+    ):
+        self.path = Path(path)
+        self.span = max(1, window // generations)
+        self.keep = generations
+        self.generations = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def digest(key: bytes) -> int:
+        """Stable 64 bit digest of *key*, unlike hash() it is the same across restarts"""
+        return int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+
+    def add(self, key: bytes) -> bool:
+        """Returns true if *key* is new within the window, otherwise false"""
+        digest = self.digest(key)
+        with self.lock:
+            current = self._rotate()
+            for generation in self.generations.values():
+                if digest in generation:
+                    return False
+            self.generations[current].add(digest)
+            self.pending.setdefault(current, array("Q")).append(digest)
+        return True
+
+    def flush(self):
+        """Appends digests added since the last flush to their generation file"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for number, digests in pending.items():
+            with open(self.path / f"{number}.bin", "ab") as fd:
+                fd.write(digests.tobytes())
+
+    def __len__(self):
+        return sum(map(len, self.generations.values()))
+
+    def _rotate(self) -> int:
+        current = int(time.time()) // self.span
+        if current not in self.generations:
+            self.generations[current] = set()
+            for number in list(self.generations):
+                if number <= current - self.keep:
+                    del self.generations[number]
+                    self.pending.pop(number, None)
+                    (self.path / f"{number}.bin").unlink(missing_ok=True)
+        return current
+
+    def _load(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        oldest = int(time.time()) // self.span - self.keep
+        for file in self.path.glob("*.bin"):
+            number = int(file.stem)
+            if number <= oldest:
+                file.unlink()
+                continue
+            data = file.read_bytes()
+            digests = array("Q")
+            digests.frombytes(data[: len(data) - len(data) % 8])  # Torn last write
+            self.generations[number] = set(digests)
+        self._rotate()
@@ -0,0 +1,71 @@
+import threading
+
+from array import array
+
+WRAP_32 = 2**32
+
+
+class Derive:
+    """Turns cumulative counter metrics into per second rates
+
+    Metrics with *counter* set are counters, *counter* being the epoch they count
+    from, like the boot id of the host, or True when there is none. The last time
+    and value of each (server, tag) series are kept in flat arrays, indexed by a
+    slot per series. The rate is the change since the last sample over the seconds
+    between their timestamps, the first sample of a series and the first after its
+    epoch changed only set the state. A counter going down in the same epoch has
+    wrapped if it fits in 32 bits and the wrapped change is less than half the
+    range, otherwise it was reset and counts from zero. Counters given as ints get
+    rates rounded to ints, so their fields keep the integer type they have in
+    InfluxDB.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.times = array("q")
+        self.values = array("d")
+        self.epochs = []
+        self.lock = threading.Lock()
+
+    def apply(self, metrics: list) -> list:
+        """Returns *metrics* with counters replaced by their rates, or dropped without one"""
+        result = []
+        with self.lock:
+            for metric in metrics:
+                if metric.counter is None:
+                    result.append(metric)
+                elif (rate := self._rate(metric)) is not None:
+                    result.append(metric._replace(value=rate, counter=None))
+        return result
+
+    def _rate(self, metric):
+        try:
+            value = float(metric.value)
+        except (TypeError, ValueError):
+            return None
+        key = metric.name, metric.tag
+        if (slot := self.slots.get(key)) is None:
+            self.slots[key] = len(self.times)
+            self.times.append(metric.time)
+            self.values.append(value)
+            self.epochs.append(metric.counter)
+            return None
+
+        elapsed = metric.time - self.times[slot]
+        if elapsed <= 0:
+            return None  # Duplicate or out of order
+        last = self.values[slot]
+        same_epoch = self.epochs[slot] == metric.counter
+        self.times[slot] = metric.time
+        self.values[slot] = value
+        self.epochs[slot] = metric.counter
+        if not same_epoch:
+            return None
+
+        delta = value - last
+        if delta < 0:
+            wrapped = value + WRAP_32 - last
+            delta = wrapped if last < WRAP_32 and wrapped < WRAP_32 / 2 else value
+        if isinstance(metric.value, int):
+            return round(delta / elapsed)
+        return delta / elapsed
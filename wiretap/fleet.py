@@ -0,0 +1,66 @@
+import logging
+import traceback
+
+from typing import List
+
+from gevent.pool import Pool
+
+from wiretap.config import settings
+from wiretap.schemas import Server
+from wiretap.scheduler import Scheduler
+from wiretap.remote import Remote, collector_intervals, collect_due
+
+log = logging.getLogger()
+
+
+class Fleet:
+    """Runs collectors on all *servers* at once from a single thread
+
+    Like ParallelSSHClient, the script of the due collectors runs on every server
+    in a gevent pool of *pool_size* greenlets, but each server keeps its own
+    Connection, so its session, backoff and state are the ones of a host thread.
+    Servers in backoff sit the run out, and the output of each server is split
+    back to the aggregators of its jobs.
+    """
+
+    def __init__(
+        self,
+        servers: List[Server],
+        config: dict,
+        pool_size: int = settings.FLEET_POOL_SIZE,
+    ):
+        self.remotes = [Remote(server, config) for server in servers]
+        self.pool = Pool(pool_size)
+
+    @property
+    def connections(self) -> dict:
+        return {remote.server.name: remote.connection for remote in self.remotes}
+
+    def run_many(self, collectors, engine):
+        """Runs the *collectors* on every server not in backoff and adds their metrics"""
+        for remote in self.remotes:
+            if remote.connection.ready():
+                self.pool.spawn(collect_due, remote, engine, collectors)
+        self.pool.join()
+
+
+def fleet_execution(servers: List[Server], engine):
+    """Collects from all *servers* in one thread, running due collectors fleet-wide
+
+    Journals are collected on the schedule even with "follow", as following needs
+    a long-lived channel per host.
+    """
+    fleet = Fleet(servers, engine.config)
+    engine.connections.update(fleet.connections)
+    scheduler = Scheduler()
+    for c, interval in collector_intervals(engine):
+        scheduler.add(c, interval)
+    engine.schedules["fleet"] = scheduler
+
+    while True:
+        due = scheduler.wait()
+        try:
+            fleet.run_many(due, engine)
+        except Exception as e:
+            log.error(f"Error in fleet execution. ({type(e)}) {e}")
+            log.error(traceback.format_exc())
@@ -1,59 +1,103 @@
-import re
 import ssl
+import time
 import socket
+import asyncio
+import logging
 import datetime
 import requests
-import subprocess
 
-from typing import Tuple
+from typing import Tuple, List
 from collections import namedtuple
-from pydantic import validate_arguments, AnyHttpUrl
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import AnyHttpUrl
 
+from wiretap.config import settings
+from wiretap.schemas import Server
+from wiretap.ping import ping_many, NO_REPLY
 
-HealthResponse = namedtuple("HealthResponse", "http_status packet_loss rtt")
+log = logging.getLogger()
+
+HealthResponse = namedtuple(
+    "HealthResponse",
+    "http_status packet_loss rtt rtt_min rtt_max jitter http_time",
+    defaults=(False, False, False, False),
+)
 CertificateResponse = namedtuple("CertificateResponse", "expires_in expires_at")
+HttpResponse = namedtuple("HttpResponse", "ok status time")
 
+_session = None
+_session_hosts = 0
+_executor = None
 
-@validate_arguments
-def http(url: AnyHttpUrl, timeout: int = 10) -> bool:
-    """Returns True if get request to url returns a 200 reponse"""
 
-    try:
-        http_response = requests.get(url, timeout=timeout)
-    except requests.exceptions.ConnectionError:
-        return False
-    return str(http_response.status_code)[0] in ["2", "3"]
+def http_session(hosts: int = 1) -> requests.Session:
+    """Session shared by all http checks, keeping connections to the hosts alive
 
+    The pools are sized for *hosts* hosts, so no host is evicted while the whole
+    inventory is checked, with a single connection each as the checks of one host
+    do not overlap.
+    """
+    global _session, _session_hosts
+    if _session is None:
+        _session = requests.Session()
+    if hosts > _session_hosts:
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=1)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session_hosts = hosts
+    return _session
 
-@validate_arguments
-def ping(host: str, count: int = 4, timeout: int = 10) -> Tuple[int, float]:
-    """Ping a host using ICMP, returns tuple with packet loss in percent and round trip time max in ms"""
 
-    ping_response = (
-        subprocess.Popen(
-            ["/bin/ping", f"-c{str(count)}", f"-w{str(timeout)}", host],
-            stdout=subprocess.PIPE,
+def http_executor() -> ThreadPoolExecutor:
+    """Threads for the http checks, one per slot of HEALTH_CONCURRENCY
+
+    Checks that got a slot start right away instead of queueing for the default
+    executor and spending their deadline there.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            settings.HEALTH_CONCURRENCY, thread_name_prefix="health"
         )
-        .stdout.read()
-        .decode("utf-8")
-    )
-    packet_loss = int(re.search(r"(\d+)% packet loss", ping_response).groups()[0])
+    return _executor
+
+
+def http_check(
+    url: AnyHttpUrl,
+    method: str = "GET",
+    expected_status: int = None,
+    timeout: int = 10,
+) -> HttpResponse:
+    """Requests *url*, ok if the status is *expected_status*, or any 2xx or 3xx without it
+
+    Returns whether the check passed, the status code and the response time in ms.
+    """
+    started = time.perf_counter()
     try:
-        rtt = float(
-            re.search(
-                r"(?:(?:[0-9]*[.])?[0-9]+)\/"
-                r"(?:(?:[0-9]*[.])?[0-9]+)\/"
-                r"((?:[0-9]*[.])?[0-9]+)\/(?:(?:[0-9]*[.])?[0-9]+) ms",
-                ping_response,
-            ).groups()[0]
-        )
-    except AttributeError:
-        rtt = False
+        http_response = http_session().request(method, url, timeout=timeout)
+    except requests.exceptions.RequestException:
+        return HttpResponse(False, None, False)
+    elapsed = (time.perf_counter() - started) * 1000
+    status = http_response.status_code
+    if expected_status is None:
+        ok = str(status)[0] in ["2", "3"]
+    else:
+        ok = status == expected_status
+    return HttpResponse(ok, status, elapsed)
+
+
+def http(url: AnyHttpUrl, timeout: int = 10) -> bool:
+    """Returns True if get request to url returns a 200 reponse"""
+    return http_check(url, timeout=timeout).ok
+
 
-    return packet_loss, rtt
+def ping(host: str, count: int = 4, timeout: int = 10) -> Tuple[int, float]:
+    """Ping a host using ICMP, returns tuple with packet loss in percent and average round trip time in ms"""
+    response = asyncio.run(ping_many([host], count=count, timeout=timeout))[host]
+    return response.packet_loss, response.rtt_avg
 
 
-@validate_arguments
 def health_check(host: str) -> HealthResponse:
     return HealthResponse(
         http(f"http://{host}", timeout=1), *ping(host, count=1, timeout=5)
@@ -77,8 +121,6 @@ def certificate_check(hostname: AnyHttpUrl, timeout: int = 10) -> CertificateRes
         Seconds until the certificate expires, or False on failure
 
     """
-    ssl_date_fmt = r"%b %d %H:%M:%S %Y %Z"
-
     try:
         context = ssl.create_default_context()
         conn = context.wrap_socket(
@@ -88,13 +130,7 @@ def certificate_check(hostname: AnyHttpUrl, timeout: int = 10) -> CertificateRes
         conn.settimeout(timeout)
 
         conn.connect((hostname, 443))
-        ssl_info = conn.getpeercert()
-        expires = datetime.datetime.strptime(ssl_info["notAfter"], ssl_date_fmt)
-
-        return CertificateResponse(
-            int((expires - datetime.datetime.utcnow()).total_seconds()),
-            int(expires.timestamp()),
-        )
+        return _certificate_response(conn.getpeercert())
 
     except ConnectionRefusedError:
         return False
@@ -104,5 +140,217 @@ def certificate_check(hostname: AnyHttpUrl, timeout: int = 10) -> CertificateRes
         return False
 
 
+def _certificate_response(ssl_info: dict) -> CertificateResponse:
+    ssl_date_fmt = r"%b %d %H:%M:%S %Y %Z"
+    expires = datetime.datetime.strptime(ssl_info["notAfter"], ssl_date_fmt)
+
+    return CertificateResponse(
+        int((expires - datetime.datetime.utcnow()).total_seconds()),
+        int(expires.timestamp()),
+    )
+
+
+class CertificateCache:
+    """Certificate expiry per host, so the TLS handshake is only done now and then
+
+    A host is checked again *refresh* seconds after its last check, or every
+    *retry* seconds once its certificate expires within *early* seconds or the
+    last check failed. *expires_in* is computed from the cached *expires_at*.
+    Hosts whose *expires_at* changed since the last successful check, usually
+    because the certificate was renewed, are collected until *pop_changes*. A failed
+    check keeps the last known *expires_at*, so a renewal is still noticed when a
+    failure falls between the two certificates.
+    """
+
+    def __init__(
+        self,
+        refresh: int = settings.CERTIFICATE_REFRESH,
+        early: int = settings.CERTIFICATE_EARLY_REFRESH,
+        retry: int = settings.CERTIFICATE_RETRY,
+    ):
+        self.refresh = refresh
+        self.early = early
+        self.retry = retry
+        self.entries = {}
+        self.changes = []
+
+    def due(self, host: str, now: float = None) -> bool:
+        if now is None:
+            now = time.time()
+        if (entry := self.entries.get(host)) is None:
+            return True
+        expires_at, checked, failed = entry
+        if failed or not expires_at or expires_at - now < self.early:
+            return now - checked >= self.retry
+        return now - checked >= self.refresh
+
+    def update(self, host: str, certificate: CertificateResponse, now: float = None):
+        if now is None:
+            now = time.time()
+        previous = self.entries.get(host, (False, None, False))[0]
+        if not certificate:
+            self.entries[host] = previous, now, True
+            return
+        expires_at = certificate.expires_at
+        if previous and previous != expires_at:
+            log.warning(
+                f"Certificate for {host} changed, expires at"
+                f" {datetime.datetime.utcfromtimestamp(expires_at)} (was"
+                f" {datetime.datetime.utcfromtimestamp(previous)})"
+            )
+            self.changes.append(host)
+        self.entries[host] = expires_at, now, False
+
+    def get(self, host: str, now: float = None) -> CertificateResponse:
+        if now is None:
+            now = time.time()
+        entry = self.entries.get(host)
+        if not entry or not entry[0] or entry[2]:
+            return False
+        return CertificateResponse(int(entry[0] - now), entry[0])
+
+    def pop_changes(self) -> List[str]:
+        changes, self.changes = self.changes, []
+        return changes
+
+
+async def _async_http(server: Server, timeout: int) -> HttpResponse:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        http_executor(),
+        http_check,
+        f"http://{server.host}{server.health_path}",
+        server.health_method,
+        server.health_status,
+        timeout,
+    )
+
+
+async def async_certificate_check(hostname: str) -> CertificateResponse:
+    """Like certificate_check, without blocking the event loop"""
+    try:
+        _, writer = await asyncio.open_connection(
+            hostname, 443, ssl=ssl.create_default_context(), server_hostname=hostname
+        )
+    except (OSError, ssl.SSLError):
+        return False
+    try:
+        return _certificate_response(writer.get_extra_info("peercert"))
+    finally:
+        writer.close()
+
+
+async def _deadline(check, deadline: float, default):
+    try:
+        return await asyncio.wait_for(check, deadline)
+    except (asyncio.TimeoutError, OSError):
+        return default
+
+
+async def _limited(check, semaphore: asyncio.Semaphore, deadline: float, default):
+    async with semaphore:
+        return await _deadline(check, deadline, default)
+
+
+async def async_health_check(
+    server: Server,
+    semaphore: asyncio.Semaphore,
+    deadline: float,
+    certificates: CertificateCache = None,
+    pinged: asyncio.Future = None,
+) -> Tuple[HealthResponse, CertificateResponse]:
+    """Runs the http, ping and certificate checks of *server* concurrently
+
+    Each check takes a slot of *semaphore* and gives up after *deadline* seconds.
+    With *certificates*, the certificate is only checked when the cache is due.
+    *pinged* is the result of a batch ping_many including the host, if already started.
+    """
+    host = server.host
+
+    async def limited(check, default):
+        return await _limited(check, semaphore, deadline, default)
+
+    async def certificate_check():
+        if certificates is None:
+            return await limited(async_certificate_check(host), False)
+        if certificates.due(host):
+            certificates.update(
+                host, await limited(async_certificate_check(host), False)
+            )
+        return certificates.get(host)
+
+    async def ping_check():
+        if pinged is None:
+            pong = ping_many([host], limit=lambda check: limited(check, []))
+            return (await pong)[host]
+        return (await asyncio.shield(pinged))[host]
+
+    checks = [
+        limited(_async_http(server, timeout=1), HttpResponse(False, None, False)),
+        ping_check(),
+        certificate_check(),
+    ]
+    defaults = [HttpResponse(False, None, False), NO_REPLY, False]
+    http_response, pong, certificate = [
+        _check_result(server, result, default)
+        for result, default in zip(
+            await asyncio.gather(*checks, return_exceptions=True), defaults
+        )
+    ]
+    return (
+        HealthResponse(
+            http_response.ok,
+            pong.packet_loss,
+            pong.rtt_avg,
+            pong.rtt_min,
+            pong.rtt_max,
+            pong.jitter,
+            http_response.time,
+        ),
+        certificate,
+    )
+
+
+def _check_result(server: Server, result, default):
+    """*result* of a check, or *default* when the check raised"""
+    if isinstance(result, Exception):
+        log.error(f"Error in health check. ({server.name}). ({type(result)}) {result}")
+        return default
+    return result
+
+
+async def probe_inventory(
+    servers: List[Server],
+    concurrency: int = settings.HEALTH_CONCURRENCY,
+    deadline: float = settings.HEALTH_DEADLINE,
+    certificates: CertificateCache = None,
+) -> dict:
+    """Health and certificate checks for all *servers* at once, at most *concurrency* running
+
+    All hosts are pinged together in one batch alongside the other checks, a TCP
+    ping takes a slot and the deadline like any other check. Returns the results
+    by host.
+    """
+    hosts = [server.host for server in servers]
+    http_session(len(hosts))
+    semaphore = asyncio.Semaphore(concurrency)
+    pinged = asyncio.ensure_future(
+        ping_many(hosts, limit=lambda check: _limited(check, semaphore, deadline, []))
+    )
+    results = await asyncio.gather(
+        *(
+            async_health_check(server, semaphore, deadline, certificates, pinged)
+            for server in servers
+        ),
+        return_exceptions=True,
+    )
+    return {
+        server.host: _check_result(
+            server, result, (HealthResponse(False, 100, False), False)
+        )
+        for server, result in zip(servers, results)
+    }
+
+
 if __name__ == "__main__":
     print(certificate_check("localhost"))
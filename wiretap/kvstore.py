@@ -0,0 +1,103 @@
+import os
+import json
+import atexit
+import threading
+
+from pathlib import Path
+
+from wiretap.config import settings
+
+
+class KeyValueStore:
+    """Key-value store kept in memory, persisted write-behind to an append-only log
+
+    Every set is appended to the log as a json line by a background thread. When the
+    log holds many more lines than there are keys it is compacted by writing a
+    snapshot to a temporary file and renaming it over the log, so a crash at any
+    point leaves either the old or the new log on disk.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.keyvalue_file,
+        flush_interval: float = settings.KEYVALUE_FLUSH_INTERVAL,
+    ):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.data = {}
+        self.pending = []
+        self.lines = 0
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self._load()
+
+        self._stop = threading.Event()
+        self.thread = threading.Thread(
+            target=self._flusher, name="thread_keyvalue", daemon=True
+        )
+        self.thread.start()
+        atexit.register(self.close)
+
+    def get(self, key: str):
+        return self.data.get(key)
+
+    def set(self, key: str, value):
+        with self.lock:
+            self.data[key] = value
+            self.pending.append(json.dumps([key, value]) + "\n")
+
+    def flush(self):
+        with self.file_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return
+            with open(self.path, "a") as fd:
+                fd.writelines(pending)
+                fd.flush()
+                os.fsync(fd.fileno())
+            self.lines += len(pending)
+            if self.lines > 1000 and self.lines > 2 * len(self.data):
+                self._compact()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    def _compact(self):
+        with self.lock:
+            lines = [
+                json.dumps([key, value]) + "\n" for key, value in self.data.items()
+            ]
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, "w") as fd:
+            fd.writelines(lines)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(temp, self.path)
+        self.lines = len(lines)
+
+    def _flusher(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _load(self):
+        legacy = self.path.with_name("keyvalue.json")
+        if not self.path.is_file() and legacy.is_file():
+            with open(legacy, "r") as fd:
+                self.data = json.load(fd)
+            self._compact()
+        elif self.path.is_file():
+            data = self.path.read_bytes()
+            if data and not data.endswith(b"\n"):
+                # Torn last write, cut it off so the next append starts a new line
+                data = data[: data.rfind(b"\n") + 1]
+                with open(self.path, "r+b") as fd:
+                    fd.truncate(len(data))
+            for line in data.decode().splitlines():
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    continue
+                self.data[key] = value
+                self.lines += 1
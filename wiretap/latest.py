@@ -0,0 +1,105 @@
+import json
+import time
+import sqlite3
+import threading
+
+from pathlib import Path
+
+from wiretap.config import settings
+
+
+class LatestIndex:
+    """Latest value and last seen time of every (server, metric) series
+
+    Kept in memory by the engine as metrics are ingested, changed series are
+    written to a SQLite database in WAL mode on *flush*, where the web workers
+    read them with *read_latest* without blocking the writer.
+    """
+
+    def __init__(self, path: str = settings.latest_file):
+        self.path = path
+        self.values = {}
+        self.changed = {}
+        self.lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS latest (name TEXT, tag TEXT, time INTEGER,"
+                " value TEXT, unit TEXT, seen INTEGER, PRIMARY KEY (name, tag))"
+            )
+
+    def update(self, metrics: list):
+        seen = int(time.time())
+        with self.lock:
+            for metric in metrics:
+                key = metric.name, metric.tag
+                current = self.values.get(key)
+                if current is None or metric.time >= current[0]:
+                    self.values[key] = self.changed[key] = (
+                        metric.time,
+                        metric.value,
+                        metric.unit,
+                        seen,
+                    )
+
+    def flush(self):
+        with self.lock:
+            changed, self.changed = self.changed, {}
+        if not changed:
+            return
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO latest VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (name, tag)"
+                " DO UPDATE SET time=excluded.time, value=excluded.value,"
+                " unit=excluded.unit, seen=excluded.seen",
+                [
+                    (name, tag, metric_time, json.dumps(value), unit, seen)
+                    for (name, tag), (metric_time, value, unit, seen) in changed.items()
+                ],
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+
+def read_latest(name: str = None, tag: str = None, path: str = settings.latest_file):
+    """Returns the latest value of every series, optionally only for *name* or *tag*"""
+    if not Path(path).is_file():
+        return []
+    query, params = "SELECT name, tag, time, value, unit, seen FROM latest", []
+    conditions = []
+    if name is not None:
+        conditions.append("name = ?")
+        params.append(name)
+    if tag is not None:
+        conditions.append("tag = ?")
+        params.append(tag)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return [
+            {
+                "name": row[0],
+                "tag": row[1],
+                "time": row[2],
+                "value": json.loads(row[3]),
+                "unit": row[4],
+                "seen": row[5],
+            }
+            for row in db.execute(query, params)
+        ]
+    finally:
+        db.close()
+
+
+def read_last_seen(path: str = settings.latest_file) -> dict:
+    """Returns the last time any metric was seen from each server"""
+    if not Path(path).is_file():
+        return {}
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return dict(db.execute("SELECT name, MAX(seen) FROM latest GROUP BY name"))
+    finally:
+        db.close()
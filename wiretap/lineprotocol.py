@@ -0,0 +1,59 @@
+import math
+
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from wiretap.schemas import Metric
+
+
+@lru_cache(maxsize=65536)
+def split_tag(tag: str) -> Tuple[str, str]:
+    """Splits a metric tag into InfluxDB measurement and field name on the first _"""
+    measurement = field_name = tag
+    if name_tuple := tag.split("_", 1):
+        if len(name_tuple) == 2:
+            measurement, field_name = name_tuple
+    return measurement, field_name
+
+
+def _escape(text: str, chars: str = ", =") -> str:
+    for char in "\\" + chars:
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+@lru_cache(maxsize=65536)
+def series_prefix(tag: str, name: str, agg_type: str, window: str = None) -> bytes:
+    """The escaped measurement, tag set and field key of a series, up to the ="""
+    measurement, field_name = split_tag(tag)
+    window_tag = f",window={_escape(window)}" if window else ""
+    return (
+        f"{_escape(measurement, ', ')},agg_type={_escape(agg_type)},"
+        f"name={_escape(name)}{window_tag} {_escape(field_name)}="
+    ).encode()
+
+
+def encode_value(value) -> bytes:
+    if isinstance(value, bool):
+        return b"true" if value else b"false"
+    if isinstance(value, int):
+        return b"%di" % value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return b'"' + str(value).replace("\\", "\\\\").replace('"', '\\"').encode() + b'"'
+
+
+def encode(metric: Metric, window: str = None) -> Optional[bytes]:
+    """Encodes *metric* as one line of InfluxDB line protocol, with time in seconds
+
+    Rolled up metrics get their *window* as an extra tag. Returns None for metrics
+    without a finite value, they have no field to write.
+    """
+    value = metric.value
+    if value is None or isinstance(value, float) and not math.isfinite(value):
+        return None
+    return b"%s%s %d" % (
+        series_prefix(metric.tag, metric.name, metric.agg_type, window),
+        encode_value(value),
+        metric.time,
+    )
@@ -0,0 +1,148 @@
+import re
+import os
+import gzip
+import json
+import time
+
+from pathlib import Path
+
+from wiretap.config import settings
+from wiretap.utils import append_file, read_reverse_order, reverse_lines
+
+
+class MetricLog:
+    """The metric file as the head of a log of rotated, compressed segments
+
+    Metrics are appended to the head. When it grows past *segment_size* bytes, or
+    its first metric is older than *segment_age* seconds, the head is moved into
+    *segment_dir* and gzipped in blocks of *index_every* lines. Every block is its
+    own gzip member, so the segment still reads as one gzip file, and the index file
+    next to it holds the time range, line count, sizes and the line number, offset
+    and compressed length of every block, which lets readers decompress one block
+    at a time.
+    """
+
+    time_re = re.compile(rb'"time": (\d+)')
+
+    def __init__(
+        self,
+        path: str = settings.metric_file,
+        segment_dir: str = settings.segment_dir,
+        segment_size: int = settings.METRIC_SEGMENT_SIZE,
+        segment_age: int = settings.METRIC_SEGMENT_AGE,
+        index_every: int = 1000,
+    ):
+        self.path = Path(path)
+        self.segment_dir = Path(segment_dir)
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.index_every = index_every
+        self._head_started = None
+
+    def append(self, lines: list):
+        """Appends the json *lines* to the head, rotating it first if it is due"""
+        if self._rotation_due():
+            self.rotate()
+        append_file(self.path, lines)
+
+    def rotate(self):
+        """Moves the head to a compressed, indexed segment and starts a new head"""
+        if not self.path.is_file() or not self.path.stat().st_size:
+            return
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        moved = self.segment_dir / f"{time.time_ns()}.jsonl"
+        os.replace(self.path, moved)
+        self.path.touch()
+        self._head_started = None
+
+        data = moved.read_bytes()
+        index = {"first": None, "last": None, "count": 0, "size": len(data)}
+        blocks, block, offset = [], [], 0
+        with open(self.segment_dir / f"{moved.stem}.tmp", "wb") as fd:
+            for n, line in enumerate(data.splitlines(keepends=True)):
+                if m := self.time_re.search(line):
+                    metric_time = int(m.group(1))
+                    if index["first"] is None or metric_time < index["first"]:
+                        index["first"] = metric_time
+                    if index["last"] is None or metric_time > index["last"]:
+                        index["last"] = metric_time
+                block.append(line)
+                index["count"] += 1
+                if len(block) == self.index_every:
+                    offset = self._write_block(fd, blocks, block, n, offset)
+                    block = []
+            if block:
+                offset = self._write_block(
+                    fd, blocks, block, index["count"] - 1, offset
+                )
+        name = f"{index['first']}-{index['last']}-{moved.stem}"
+        os.replace(
+            self.segment_dir / f"{moved.stem}.tmp",
+            self.segment_dir / f"{name}.jsonl.gz",
+        )
+        index["compressed"] = offset
+        index["blocks"] = blocks
+        with open(self.segment_dir / f"{name}.idx", "w") as fd:
+            json.dump(index, fd)
+        moved.unlink()
+
+    @staticmethod
+    def _write_block(fd, blocks: list, block: list, last: int, offset: int) -> int:
+        """Writes *block* as one gzip member, records it and returns the next offset"""
+        compressed = gzip.compress(b"".join(block))
+        fd.write(compressed)
+        blocks.append([last - len(block) + 1, offset, len(compressed)])
+        return offset + len(compressed)
+
+    def segments(self, start: int = None, end: int = None) -> list:
+        """Indexes of the segments overlapping *start* - *end*, newest first"""
+        segments = []
+        for path in self.segment_dir.glob("*.idx"):
+            with open(path, "r") as fd:
+                index = json.load(fd)
+            if start is not None and (index["last"] or 0) < start:
+                continue
+            if end is not None and (index["first"] or 0) > end:
+                continue
+            index["path"] = str(path.with_suffix(".jsonl.gz"))
+            segments.append(index)
+        return sorted(
+            segments, key=lambda x: (x["first"] or 0, x["path"]), reverse=True
+        )
+
+    def read_reverse(self, start: int = None, end: int = None):
+        """Yields the lines of the head and then the segments, newest first
+
+        Segments are decompressed one block at a time, from their last block back.
+        """
+        if self.path.is_file():
+            yield from read_reverse_order(str(self.path))
+        for segment in self.segments(start, end):
+            blocks = segment.get("blocks") or [[0, 0, segment["compressed"]]]
+            with open(segment["path"], "rb") as fd:
+                for _, offset, length in reversed(blocks):
+                    fd.seek(offset)
+                    data = gzip.decompress(fd.read(length))
+                    yield from reverse_lines(data.rstrip(b"\n"))
+
+    def stats(self):
+        """Counts the lines and bytes in the log, uncompressed, by reading the head"""
+        count = size = 0
+        if self.path.is_file():
+            data = self.path.read_bytes()
+            count, size = data.count(b"\n"), len(data)
+        for segment in self.segments():
+            count += segment["count"]
+            size += segment["size"]
+        return count, size
+
+    def _rotation_due(self) -> bool:
+        if not self.path.is_file() or not (size := self.path.stat().st_size):
+            return False
+        if size >= self.segment_size:
+            return True
+        if self._head_started is None:
+            with open(self.path, "rb") as fd:
+                m = self.time_re.search(fd.readline())
+            self._head_started = int(m.group(1)) if m else time.time()
+        return time.time() - self._head_started >= self.segment_age
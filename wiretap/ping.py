@@ -0,0 +1,170 @@
+import time
+import socket
+import struct
+import asyncio
+
+from typing import List
+from collections import namedtuple
+
+from wiretap.config import settings
+
+PingResponse = namedtuple("PingResponse", "packet_loss rtt_min rtt_avg rtt_max jitter")
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(seq: int) -> bytes:
+    """ICMP echo request, the kernel sets the identifier of datagram sockets"""
+    payload = b"wiretap"
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, 0, seq)
+    checksum = _checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, 0, seq) + payload
+
+
+NO_REPLY = PingResponse(100, False, False, False, False)
+
+
+def _response(sent: int, rtts: List[float]) -> PingResponse:
+    if not rtts:
+        return NO_REPLY
+    jitter = (
+        sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+        if len(rtts) > 1
+        else 0.0
+    )
+    return PingResponse(
+        int(100 - 100 * len(rtts) / sent),
+        min(rtts),
+        sum(rtts) / len(rtts),
+        max(rtts),
+        jitter,
+    )
+
+
+def icmp_socket() -> socket.socket:
+    """Unprivileged ICMP datagram socket, or None if net.ipv4.ping_group_range denies it"""
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except OSError:
+        return None
+    sock.setblocking(False)
+    return sock
+
+
+async def _resolve(host: str) -> str:
+    loop = asyncio.get_running_loop()
+    try:
+        info = await loop.getaddrinfo(host, None, family=socket.AF_INET)
+    except OSError:
+        return None
+    return info[0][4][0]
+
+
+async def _icmp_ping(
+    sock, addresses: dict, count: int, interval: float, timeout: float
+):
+    """Pings all *addresses* (host -> ip) over one socket, returns host -> list of rtts"""
+    loop = asyncio.get_running_loop()
+    rtts = {host: [] for host in addresses}
+    pending = {}
+    done = loop.create_future()
+
+    def receive():
+        while True:
+            try:
+                data, (address, _) = sock.recvfrom(1024)
+            except OSError:
+                return
+            if len(data) < 8 or data[0] != ICMP_ECHO_REPLY:
+                continue
+            key = address, struct.unpack("!H", data[6:8])[0]
+            if (sent := pending.pop(key, None)) is not None:
+                host, sent_at = sent
+                rtts[host].append((time.perf_counter() - sent_at) * 1000)
+                if not pending and not done.done():
+                    done.set_result(None)
+
+    loop.add_reader(sock.fileno(), receive)
+    try:
+        hosts = list(addresses.items())
+        for i in range(count):
+            for n, (host, address) in enumerate(hosts):
+                seq = (n * count + i) & 0xFFFF
+                pending[address, seq] = host, time.perf_counter()
+                try:
+                    sock.sendto(_echo_request(seq), (address, 0))
+                except OSError:
+                    pending.pop((address, seq), None)
+            if i < count - 1:
+                await asyncio.sleep(interval)
+        if pending:
+            try:
+                await asyncio.wait_for(asyncio.shield(done), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        loop.remove_reader(sock.fileno())
+    return rtts
+
+
+async def _tcp_ping(host: str, port: int, count: int, interval: float, timeout: float):
+    """Times TCP connects to *host*, a refused connection counts as a reply"""
+    rtts = []
+    for i in range(count):
+        if i:
+            await asyncio.sleep(interval)
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout
+            )
+            writer.close()
+        except ConnectionRefusedError:
+            pass
+        except (OSError, asyncio.TimeoutError):
+            continue
+        rtts.append((time.perf_counter() - started) * 1000)
+    return rtts
+
+
+async def ping_many(
+    hosts: List[str],
+    count: int = settings.PING_COUNT,
+    interval: float = settings.PING_INTERVAL,
+    timeout: float = settings.PING_TIMEOUT,
+    port: int = settings.PING_TCP_PORT,
+    limit=None,
+) -> dict:
+    """Pings all *hosts* at once, returns a PingResponse per host
+
+    Echo requests for every host go out over one unprivileged ICMP socket. Hosts
+    without an IPv4 address, or all hosts if ICMP sockets are not permitted, are
+    timed with TCP connects to *port* instead. *limit* wraps the TCP ping of each
+    host, to run it in a slot of a semaphore for example, otherwise they all run at
+    once.
+    """
+    addresses = dict(zip(hosts, await asyncio.gather(*map(_resolve, hosts))))
+    sock = icmp_socket()
+    icmp_hosts = {host: a for host, a in addresses.items() if a and sock}
+    rtts = {}
+    try:
+        if icmp_hosts:
+            rtts.update(await _icmp_ping(sock, icmp_hosts, count, interval, timeout))
+    finally:
+        if sock:
+            sock.close()
+    tcp_hosts = [host for host in hosts if host not in icmp_hosts]
+    tcp_pings = (_tcp_ping(host, port, count, interval, timeout) for host in tcp_hosts)
+    results = await asyncio.gather(*(map(limit, tcp_pings) if limit else tcp_pings))
+    rtts.update(zip(tcp_hosts, results))
+    return {host: _response(count, rtts[host]) for host in hosts}
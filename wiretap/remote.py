@@ -1,50 +1,122 @@
+import os
+import signal
 import logging
+import secrets
 import subprocess
 import time
+import threading
 import traceback
 
-from pssh.exceptions import SessionError
-from pssh.clients import SSHClient
-
 from wiretap import collectors
 from wiretap.config import settings
 from wiretap.schemas import Server
+from wiretap.scheduler import Scheduler
+from wiretap.connection import Connection, CONNECTION_ERRORS
 
 log = logging.getLogger()
 
 ALL_COLLECTORS = [
     collectors.journalctl,
-    collectors.cpu,
-    collectors.memory,
+    collectors.proc,
     collectors.disk,
-    collectors.network,
     collectors.files,
+    collectors.nginx,
 ]
 
 
+def is_localhost(server: Server) -> bool:
+    return server.host in ["localhost", "127.0.0.1"]
+
+
 class Remote:
     """Establish a ssh connection to the *server* and run collectors"""
 
-    def __init__(self, server: Server, config: dict):
+    def __init__(self, server: Server, config: dict, connection: Connection = None):
         self.server = server
         self.config = config
-        self._is_localhost = self.server.host in ["localhost", "127.0.0.1"]
+        self._is_localhost = is_localhost(server)
+        self._delimiter = f"--wiretap-{secrets.token_hex(8)}--"
+        self.connection = None
 
         if not self._is_localhost:
-            self._establish_connection()
+            self.connection = connection or Connection(server)
+
+    @property
+    def client(self):
+        return self.connection.client
 
     def run(self, collector):
         """Executes the *collector* on the remote, using the config from the *server*."""
 
+        for _, response in self.run_many([collector]):
+            yield response
+
+    def run_many(self, collectors):
+        """Executes all *collectors* on the remote in a single round-trip
+
+        The commands are joined into one script, each followed by a delimiter on its
+        own line, and the output is split back on the delimiter to the aggregator
+        of each command. Yields the collector and the response of each aggregator.
+        """
+
+        jobs, script = self.script(collectors)
+        if not jobs:
+            return
+        yield from self.responses(jobs, self._run_command(script))
+
+    def script(self, collectors):
+        """Returns the jobs of the *collectors* and the script running them all"""
+        jobs = []
+        for collector in collectors:
+            config = self._get_config_for_collector(collector)
+            for command, aggregator in collector(config):
+                jobs.append((collector, command, aggregator, config))
+
+        script = "\n".join(
+            f"{{ {command}\n}}; printf '\\n%s\\n' '{self._delimiter}'"
+            for _, command, _, _ in jobs
+        )
+        return jobs, script
+
+    def responses(self, jobs, text_response):
+        """Splits the output of a script back to the aggregators of its *jobs*"""
+        sections = self._split_sections(text_response)
+        for (collector, command, aggregator, config), lines in zip(jobs, sections):
+            yield collector, aggregator(iter(lines), config)
+
+    def stream(self, collector, **kwargs):
+        """Executes the *collector* on a long-lived channel
+
+        The aggregator gets the output line by line as it arrives, and its response
+        is yielded until the remote command exits.
+        """
+
         config = self._get_config_for_collector(collector)
+        for command, aggregator in collector(config, **kwargs):
+            yield aggregator(self._stream_command(command), config)
+
+    def _split_sections(self, text_response):
+        """Splits the output on the delimiter lines
 
-        for command, aggregator in collector(config):
-            text_response = self._run_command(command)
-            yield aggregator(text_response, config)
+        The delimiter goes out after a newline, so it starts its own line even when
+        the output of a command does not end with one. For output that does, this
+        adds an empty line, which is dropped.
+        """
+        section = []
+        for line in text_response:
+            if line == self._delimiter:
+                if section and not section[-1]:
+                    section.pop()
+                yield section
+                section = []
+            else:
+                section.append(line)
 
     def _run_command(self, command):
         if not self._is_localhost:
-            server_response = self.client.run_command(command)
+            server_response = self.client.run_command(
+                command, read_timeout=settings.SSH_READ_TIMEOUT
+            )
             if stderr := list(server_response.stderr):
                 log.error(stderr)
             return server_response.stdout
@@ -59,42 +131,138 @@ class Remote:
                     return []
                 raise
 
-    def _establish_connection(self):
-        self.client = SSHClient(
-            self.server.host, user=self.server.username, pkey=settings.pkey_path
-        )
+    def _stream_command(self, command):
+        """Yields the output lines of *command*, stopping all of it when closed
+
+        Remote commands get a pty, so closing the channel hangs up the whole
+        pipeline. Local ones run in their own session and the group is killed.
+        """
+        if not self._is_localhost:
+            client = self.client
+            output = client.run_command(command, use_pty=True)
+            try:
+                for line in output.stdout:
+                    yield line.rstrip("\r")
+            finally:
+                client.close_channel(output.channel)
+        else:
+            process = subprocess.Popen(
+                command,
+                shell=True,
+                text=True,
+                stdout=subprocess.PIPE,
+                start_new_session=True,
+            )
+            try:
+                for line in process.stdout:
+                    yield line.rstrip("\n")
+            finally:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                process.wait()
 
     def _get_config_for_collector(self, collector):
-        config = self.config.get(collector.__name__.lower()) or {}
+        config = dict(self.config.get(collector.__name__.lower()) or {})
         config["name"] = self.server.name
         return config
 
 
+def collector_intervals(engine):
+    """Yields the collectors of the *engine* with their intervals from the config"""
+    for c in engine.collectors:
+        interval = settings.COLLECTION_INTERVAL
+        if config := engine.config.get(c.__name__.lower()):
+            interval = int(config.get("interval", interval))
+        yield c, interval
+
+
 def remote_execution(server, engine):
     remote = Remote(server, engine.config)
-    epoch = int(time.time())
+    if remote.connection:
+        engine.connections[server.name] = remote.connection
+    scheduler = Scheduler()
+    for c, interval in collector_intervals(engine):
+        if c is collectors.journalctl and _follow_journal(engine.config):
+            follow_thread = threading.Thread(
+                target=journal_follow,
+                args=(server, engine),
+                name=f"thread_{server.name}_journal",
+                daemon=True,
+            )
+            engine.threads.append(follow_thread)
+            follow_thread.start()
+            continue
+        scheduler.add(c, interval)
+    engine.schedules[server.name] = scheduler
+
     while True:
-        clock = int(time.time()) - epoch
-        try:
-            for c in engine.collectors:
-                interval = 60
-                if config := engine.config.get(c.__name__.lower()):
-                    interval = int(config.get("interval", 60))
-                if clock % interval == 0:
-                    for response in remote.run(c):
-                        for metric in response:
-                            engine.add_metric(server, metric)
-
-        except SessionError as e:
-            log.error(f"Session error: {e}")
-            time.sleep(900)
-            remote = Remote(server, engine.config)
-        except Exception as e:
+        due = scheduler.wait()
+        if remote.connection:
+            remote.connection.wait()
+        collect_due(remote, engine, due)
+
+
+def collect_due(remote, engine, due):
+    """Runs the *due* collectors on *remote* and adds their metrics
+
+    Connection errors, a command that stopped sending output included, put the
+    connection of the remote in backoff.
+    """
+    server = remote.server
+    try:
+        for collector, response in remote.run_many(due):
+            collect_response(server, engine, collector, response)
+        if remote.connection:
+            remote.connection.succeeded()
+
+    except CONNECTION_ERRORS as e:
+        if remote.connection:
+            remote.connection.failed(e)
+        else:
             log.error(f"Error in remote execution. ({server.name}). ({type(e)}) {e}")
-            log.error(traceback.print_exc())
-            break
+    except Exception as e:
+        log.error(f"Error in remote execution. ({server.name}). ({type(e)}) {e}")
+        log.error(traceback.format_exc())
+
+
+def collect_response(server, engine, collector, response):
+    """Adds the metrics of one collector, its failures do not affect the others"""
+    try:
+        engine.add_metrics(server, response, collector.__name__)
+    except CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        log.error(
+            f"Error in collector {collector.__name__} ({server.name}). ({type(e)}) {e}"
+        )
+        log.error(traceback.format_exc())
+
 
-        if clock > 3600:
-            epoch = int(time.time())
+def _follow_journal(config: dict) -> bool:
+    return bool((config.get("journalctl") or {}).get("follow"))
 
-        time.sleep(0.5)
+
+def journal_follow(server, engine):
+    """Follows the journal of *server* on its own connection, adding metrics as they arrive"""
+    remote = Remote(server, engine.config)
+    if remote.connection:
+        engine.connections[f"{server.name}_journal"] = remote.connection
+    while True:
+        try:
+            for response in remote.stream(collectors.journalctl, follow=True):
+                for metric in response:
+                    engine.add_metrics(server, [metric], "journalctl")
+                if remote.connection:
+                    remote.connection.succeeded()
+            log.error(f"Journal follow ended ({server.name}), restarting")
+        except CONNECTION_ERRORS as e:
+            if remote.connection:
+                remote.connection.failed(e)
+                remote.connection.wait()
+                continue
+            log.error(f"Error in journal follow. ({server.name}). ({type(e)}) {e}")
+        except Exception as e:
+            log.error(f"Error in journal follow. ({server.name}). ({type(e)}) {e}")
+        time.sleep(10)
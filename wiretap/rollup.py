@@ -0,0 +1,92 @@
+import time
+import threading
+
+from typing import List
+
+from wiretap.config import settings
+from wiretap.schemas import Metric
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def window_seconds(label: str) -> int:
+    """Length in seconds of a window label like 1m, 5m or 1h"""
+    return int(label[:-1]) * UNITS[label[-1]]
+
+
+class Rollup:
+    """Downsamples numeric metrics into fixed windows as they are ingested
+
+    Keeps count, sum and last value per series and window in memory.
+    A window is finished when a metric of a later window arrives for its series, or
+    *grace* seconds after it ended. Finished windows become one metric each, with
+    the value given by the agg_type of the series: the mean for "mean", the sum for
+    "count" and the last value for anything else ("nop").
+    """
+
+    def __init__(
+        self,
+        windows: List[str] = settings.ROLLUP_WINDOWS,
+        grace: int = settings.ROLLUP_GRACE,
+    ):
+        self.windows = [(label, window_seconds(label)) for label in windows]
+        self.seconds = dict(self.windows)
+        self.grace = grace
+        self.open = {}
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def add(self, metrics: list):
+        with self.lock:
+            for metric in metrics:
+                try:
+                    value = float(metric.value)
+                except (TypeError, ValueError):
+                    continue
+                for label, seconds in self.windows:
+                    start = metric.time - metric.time % seconds
+                    key = metric.name, metric.tag, label
+                    window = self.open.get(key)
+                    if window and window[0] != start:
+                        if start < window[0]:
+                            continue  # Late for a finished window
+                        self.finished.append(self._finish(key, window))
+                        window = None
+                    if window is None:
+                        self.open[key] = [
+                            start,
+                            1,
+                            value,
+                            value,
+                            metric.agg_type,
+                            metric.unit,
+                        ]
+                    else:
+                        window[1] += 1
+                        window[2] += value
+                        window[3] = value
+
+    def collect(self, now: float = None) -> list:
+        """Returns the finished windows as (window label, metric) pairs"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for key, window in list(self.open.items()):
+                if window[0] + self.seconds[key[2]] + self.grace <= now:
+                    self.finished.append(self._finish(key, self.open.pop(key)))
+            finished, self.finished = self.finished, []
+        return finished
+
+    @staticmethod
+    def _finish(key, window):
+        name, tag, label = key
+        start, count, total, last, agg_type, unit = window
+        if agg_type == "mean":
+            value = total / count
+        elif agg_type == "count":
+            value = total
+        else:
+            value = last
+        return label, Metric(
+            tag=tag, time=start, value=value, unit=unit, agg_type=agg_type, name=name
+        )
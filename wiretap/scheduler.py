@@ -0,0 +1,93 @@
+import time
+import heapq
+import random
+import logging
+
+import gevent
+
+from itertools import count
+
+from wiretap.config import settings
+
+log = logging.getLogger()
+
+
+class Scheduler:
+    """Runs jobs on fixed intervals, keeping the next deadline of every job on a heap
+
+    The first run of each job is offset by a random part of its interval (*jitter*)
+    so hosts started together do not poll in lockstep. When a run is late by one or
+    more whole intervals, *overrun* decides what happens to the slots that passed:
+    "skip" drops them, "catchup" runs them back to back, up to *max_catchup* runs.
+    """
+
+    def __init__(
+        self,
+        jitter: float = settings.SCHEDULE_JITTER,
+        overrun: str = settings.SCHEDULE_OVERRUN,
+        late_after: float = settings.SCHEDULE_LATE_AFTER,
+        max_catchup: int = settings.SCHEDULE_MAX_CATCHUP,
+    ):
+        assert overrun in ["skip", "catchup"]
+        self.jitter = jitter
+        self.overrun = overrun
+        self.late_after = late_after
+        self.max_catchup = max_catchup
+        self.heap = []
+        self.intervals = {}
+        self.stats = {}
+        self._order = count()
+
+    def add(self, key, interval: float):
+        """Schedules *key* to be due every *interval* seconds"""
+        self.intervals[key] = interval
+        self.stats[key] = {"runs": 0, "missed": 0, "late": 0}
+        deadline = time.monotonic() + random.uniform(0, interval * self.jitter)
+        heapq.heappush(self.heap, (deadline, next(self._order), key))
+
+    def wait(self) -> list:
+        """Sleeps until the next deadline and returns the keys that are due
+
+        With nothing scheduled, like a host whose only collector is a followed
+        journal, it keeps sleeping instead of returning. It sleeps on gevent, so the
+        keepalive greenlets pssh runs for the ssh sessions of this thread keep
+        sending while the thread waits.
+        """
+        while not (due := self.pop_due()):
+            if not self.heap:
+                gevent.sleep(60)
+                continue
+            gevent.sleep(max(0, self.heap[0][0] - time.monotonic()))
+        return due
+
+    def pop_due(self, now: float = None) -> list:
+        """Returns the keys that are due at *now* and schedules their next run"""
+        if now is None:
+            now = time.monotonic()
+        due, later = [], []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self.heap)
+            interval = self.intervals[key]
+            stats = self.stats[key]
+            stats["runs"] += 1
+            if now - deadline > self.late_after:
+                stats["late"] += 1
+
+            next_deadline = deadline + interval
+            if passed := int((now - deadline) // interval):
+                if self.overrun == "catchup":
+                    skipped = max(0, passed - self.max_catchup)
+                else:
+                    skipped = passed
+                if skipped:
+                    stats["missed"] += skipped
+                    next_deadline += skipped * interval
+                    log.error(
+                        f"Scheduler overrun, skipped {skipped} run(s) of {getattr(key, '__name__', key)}"
+                    )
+
+            due.append(key)
+            later.append((next_deadline, next(self._order), key))
+        for item in later:
+            heapq.heappush(self.heap, item)
+        return due
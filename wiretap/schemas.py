@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Callable, Union, Any, Optional
+from typing import Callable, Union, Any, Optional, NamedTuple, Tuple, List
 
 
 class Server(BaseModel):
@@ -8,6 +8,15 @@ class Server(BaseModel):
         ..., regex=r"[a-z0-9\.\-]{3,100}", description="Domain name or IP"
     )
     username: str = Field("ubuntu")
+    health_path: str = Field(
+        "",
+        regex=r"^(/.*)?$",
+        description="Path requested by the http health check, starting with /",
+    )
+    health_method: str = Field("GET", regex=r"^(GET|HEAD)$")
+    health_status: Optional[int] = Field(
+        None, description="Expected http status, any 2xx or 3xx if not set"
+    )
 
 
 class Record(BaseModel):
@@ -22,13 +31,40 @@ class LogRecord(Record):
     cursor: str = Field(..., alias="__CURSOR")
 
 
-class Metric(BaseModel):
+class JournalRule(BaseModel):
+    regex: Tuple[str, str] = Field(
+        ...,
+        description="Extended regex egrep matches against the json records, and Python regex extracting the groups from the message",
+    )
+    tag: str
+    agg_type: str = "mean"
+
+
+class UrlGroup(BaseModel):
+    tag: str
+    regex: str = Field(..., description="Regex matched against the start of the url")
+
+
+class FileRule(BaseModel):
+    path: str = Field(..., regex=r"^[^\n]+$")
+    tag: str
+    agg_type: str = "mean"
+    hosts: Optional[List[str]]
+
+
+class Metric(NamedTuple):
+    """A single sample, plain tuple to keep it cheap from collectors to sinks
+
+    Not validated, collectors are trusted to give *time* as an int. *agg_type* is the
+    aggregation function (if any) to use when downsampling metrics. *counter* marks
+    a cumulative counter to store as a per second rate, set to the epoch it counts
+    from (the boot id of the host) or True.
+    """
+
     tag: str
     time: int
     value: Any
-    unit: Optional[str]
-    agg_type: str = Field(
-        "mean",
-        description="The aggregation function (if any) to use when downsampling metrics",
-    )
-    name: Optional[str]
+    unit: Optional[str] = None
+    agg_type: str = "mean"
+    name: Optional[str] = None
+    counter: Any = None
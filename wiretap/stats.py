@@ -0,0 +1,79 @@
+import os
+import json
+import threading
+
+from pathlib import Path
+
+from wiretap.config import settings
+
+
+class Stats:
+    """Running counters of what the engine has stored, kept across restarts
+
+    Counts points and bytes per collector and per host as they are stored, and
+    duplicates and drops along the way. *flush* writes the totals to a json file
+    through a temporary file and a rename, *read_stats* reads them from the web.
+    """
+
+    def __init__(self, path: str = settings.stats_file):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.counters = {
+            "points": 0,
+            "bytes": 0,
+            "duplicates": 0,
+            "influx_written": 0,
+            "influx_failed": 0,
+            "influx_dropped": 0,
+            "collectors": {},
+            "hosts": {},
+        }
+        self._writer_last = {}
+        if self.path.is_file():
+            with open(self.path, "r") as fd:
+                saved = json.load(fd)
+            self.counters.update({k: v for k, v in saved.items() if k in self.counters})
+
+    def is_new(self) -> bool:
+        return not self.path.is_file()
+
+    def seed(self, points: int, nbytes: int):
+        """Starts the counters from what is already stored"""
+        with self.lock:
+            self.counters["points"] = points
+            self.counters["bytes"] = nbytes
+
+    def add(self, host: str, collector: str, points: int, duplicates: int = 0):
+        with self.lock:
+            self.counters["points"] += points
+            self.counters["duplicates"] += duplicates
+            for group, key in [("collectors", collector), ("hosts", host)]:
+                counts = self.counters[group]
+                counts[key] = counts.get(key, 0) + points
+
+    def add_bytes(self, nbytes: int):
+        with self.lock:
+            self.counters["bytes"] += nbytes
+
+    def flush(self, writer=None, extra: dict = None):
+        """Saves the counters, adding what *writer* has written, failed or dropped since last time"""
+        with self.lock:
+            if writer:
+                for key in ["written", "failed", "dropped"]:
+                    value = getattr(writer, key)
+                    self.counters[f"influx_{key}"] += value - self._writer_last.get(
+                        key, 0
+                    )
+                    self._writer_last[key] = value
+            data = json.dumps({**self.counters, **(extra or {})})
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, "w") as fd:
+            fd.write(data)
+        os.replace(temp, self.path)
+
+
+def read_stats(path: str = settings.stats_file) -> dict:
+    if not Path(path).is_file():
+        return {}
+    with open(path, "r") as fd:
+        return json.load(fd)
@@ -0,0 +1,299 @@
+import re
+import time
+import struct
+import sqlite3
+import threading
+
+from pathlib import Path
+
+from wiretap.config import settings
+
+
+class BitWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.acc = 0
+        self.nbits = 0
+
+    def write(self, value: int, nbits: int):
+        self.acc = (self.acc << nbits) | (value & ((1 << nbits) - 1))
+        self.nbits += nbits
+        while self.nbits >= 8:
+            self.nbits -= 8
+            self.buffer.append((self.acc >> self.nbits) & 0xFF)
+        self.acc &= (1 << self.nbits) - 1
+
+    def getvalue(self) -> bytes:
+        if self.nbits:
+            return bytes(self.buffer) + bytes([(self.acc << (8 - self.nbits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self.value = int.from_bytes(data, "big")
+        self.left = len(data) * 8
+
+    def read(self, nbits: int) -> int:
+        self.left -= nbits
+        return (self.value >> self.left) & ((1 << nbits) - 1)
+
+
+def _float_bits(value: float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+# Delta-of-delta ranges and how they are written: control bits, control length, value length
+_DOD_BUCKETS = [(64, 0b10, 2, 7), (256, 0b110, 3, 9), (2048, 0b1110, 4, 12)]
+
+
+class Chunk:
+    """Points of one series compressed as in Facebook's Gorilla paper
+
+    Timestamps are stored as delta-of-deltas in variable size buckets, values as the
+    XOR with the previous value, reusing the previous leading/trailing zero window
+    when the meaningful bits fit in it.
+    """
+
+    def __init__(self, start: int, value: float):
+        self.start = self.end = start
+        self.count = 1
+        self.bits = BitWriter()
+        self.bits.write(_float_bits(value), 64)
+        self._delta = 0
+        self._value = _float_bits(value)
+        self._leading = self._trailing = None
+
+    def append(self, timestamp: int, value: float):
+        delta = timestamp - self.end
+        dod = delta - self._delta
+        if dod == 0:
+            self.bits.write(0, 1)
+        else:
+            for limit, control, control_bits, value_bits in _DOD_BUCKETS:
+                if -limit <= dod < limit:
+                    self.bits.write(control, control_bits)
+                    self.bits.write(dod, value_bits)
+                    break
+            else:
+                self.bits.write(0b1111, 4)
+                self.bits.write(dod, 32)
+        self._delta = delta
+        self.end = timestamp
+
+        bits = _float_bits(value)
+        xor = bits ^ self._value
+        self._value = bits
+        if xor == 0:
+            self.bits.write(0, 1)
+        else:
+            leading = min(31, 64 - xor.bit_length())
+            trailing = (xor & -xor).bit_length() - 1
+            if (
+                self._leading is not None
+                and leading >= self._leading
+                and trailing >= self._trailing
+            ):
+                self.bits.write(0b10, 2)
+                self.bits.write(
+                    xor >> self._trailing, 64 - self._leading - self._trailing
+                )
+            else:
+                self._leading, self._trailing = leading, trailing
+                self.bits.write(0b11, 2)
+                self.bits.write(leading, 5)
+                self.bits.write(64 - leading - trailing - 1, 6)
+                self.bits.write(xor >> trailing, 64 - leading - trailing)
+        self.count += 1
+
+    def data(self) -> bytes:
+        return self.bits.getvalue()
+
+
+def _signed(value: int, nbits: int) -> int:
+    return value - (1 << nbits) if value >= 1 << (nbits - 1) else value
+
+
+def decode(start: int, count: int, data: bytes):
+    """Yields the (timestamp, value) points of a chunk"""
+    bits = BitReader(data)
+    timestamp, delta = start, 0
+    value = bits.read(64)
+    leading = trailing = 0
+    yield timestamp, _bits_float(value)
+    for _ in range(count - 1):
+        if bits.read(1):
+            for limit, control, control_bits, value_bits in _DOD_BUCKETS:
+                if not bits.read(1):
+                    delta += _signed(bits.read(value_bits), value_bits)
+                    break
+            else:
+                delta += _signed(bits.read(32), 32)
+        timestamp += delta
+
+        if bits.read(1):
+            if bits.read(1):
+                leading = bits.read(5)
+                trailing = 64 - leading - bits.read(6) - 1
+            value ^= bits.read(64 - leading - trailing) << trailing
+        yield timestamp, _bits_float(value)
+
+
+class TimeSeriesStore:
+    """Local store of numeric metrics, compressed per series in chunks, in SQLite
+
+    Every (server, tag) series has an open chunk in memory, closed at *chunk_points*
+    points, points older than the last one of their series are dropped. *flush*
+    writes the closed chunks and replaces the stored copy of the open ones, so the
+    web workers can query everything up to the last flush. Chunks older than
+    *retention* seconds are deleted.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.tsdb_file,
+        chunk_points: int = settings.TSDB_CHUNK_POINTS,
+        retention: int = settings.TSDB_RETENTION,
+    ):
+        self.path = path
+        self.chunk_points = chunk_points
+        self.retention = retention
+        self.series = {}
+        self.open = {}
+        self.closed = []
+        self.changed = set()
+        self.lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, name TEXT,"
+                " tag TEXT, UNIQUE (name, tag))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (series INTEGER, start INTEGER,"
+                " end INTEGER, count INTEGER, data BLOB, PRIMARY KEY (series, start))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS chunks_end ON chunks (end)")
+            self.series = {
+                (name, tag): series_id
+                for series_id, name, tag in db.execute(
+                    "SELECT id, name, tag FROM series"
+                )
+            }
+
+    def add(self, metrics: list):
+        with self.lock:
+            for metric in metrics:
+                try:
+                    value = float(metric.value)
+                except (TypeError, ValueError):
+                    continue
+                key = metric.name, metric.tag
+                chunk = self.open.get(key)
+                if chunk and metric.time <= chunk.end:
+                    continue  # Out of order
+                if chunk and chunk.count < self.chunk_points:
+                    chunk.append(metric.time, value)
+                else:
+                    if chunk:
+                        self.closed.append((key, chunk))
+                    self.open[key] = Chunk(metric.time, value)
+                self.changed.add(key)
+
+    def flush(self):
+        with self.lock:
+            closed, self.closed = self.closed, []
+            changed, self.changed = self.changed, set()
+            chunks = closed + [(key, self.open[key]) for key in changed]
+            rows = [(key, c.start, c.end, c.count, c.data()) for key, c in chunks]
+        if not rows:
+            return
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                [(self._series_id(db, key), *row) for key, *row in rows],
+            )
+            db.execute(
+                "DELETE FROM chunks WHERE end < ?", (int(time.time()) - self.retention,)
+            )
+
+    def _series_id(self, db, key) -> int:
+        if (series_id := self.series.get(key)) is None:
+            db.execute("INSERT OR IGNORE INTO series (name, tag) VALUES (?, ?)", key)
+            series_id = db.execute(
+                "SELECT id FROM series WHERE name = ? AND tag = ?", key
+            ).fetchone()[0]
+            self.series[key] = series_id
+        return series_id
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+
+def _glob(pattern: str) -> str:
+    """GLOB pattern matching *pattern* case-sensitively with only * as wildcard"""
+    return re.sub(r"([?[])", r"[\1]", pattern)
+
+
+def _series_filter(name: str = None, tag: str = None):
+    conditions, params = [], []
+    if name is not None:
+        conditions.append("series.name GLOB ?")
+        params.append(_glob(name))
+    if tag is not None:
+        conditions.append("series.tag GLOB ?")
+        params.append(_glob(tag))
+    return conditions, params
+
+
+def _read(path: str, query: str, params: list):
+    if not Path(path).is_file():
+        return []
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return db.execute(query, params).fetchall()
+    finally:
+        db.close()
+
+
+def list_series(name: str = None, tag: str = None, path: str = settings.tsdb_file):
+    """Returns the stored series, optionally only for server *name* and *tag* (* as wildcard)"""
+    conditions, params = _series_filter(name, tag)
+    query = "SELECT name, tag FROM series"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return [{"name": name, "tag": tag} for name, tag in _read(path, query, params)]
+
+
+def query(
+    start: int,
+    end: int,
+    name: str = None,
+    tag: str = None,
+    path: str = settings.tsdb_file,
+):
+    """Returns the points between *start* and *end* of the series matching *name* and *tag*"""
+    conditions, params = _series_filter(name, tag)
+    conditions += ["chunks.end >= ?", "chunks.start <= ?"]
+    params += [start, end]
+    rows = _read(
+        path,
+        "SELECT series.name, series.tag, chunks.start, chunks.count, chunks.data"
+        " FROM chunks JOIN series ON series.id = chunks.series"
+        f" WHERE {' AND '.join(conditions)} ORDER BY chunks.series, chunks.start",
+        params,
+    )
+    result = {}
+    for series_name, series_tag, chunk_start, count, data in rows:
+        points = result.setdefault((series_name, series_tag), [])
+        points.extend(
+            [t, v] for t, v in decode(chunk_start, count, data) if start <= t <= end
+        )
+    return [
+        {"name": series_name, "tag": series_tag, "points": points}
+        for (series_name, series_tag), points in result.items()
+    ]
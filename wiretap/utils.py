@@ -1,38 +1,35 @@
 import os
 import json
+import mmap
 import threading
-import subprocess
 
 from typing import List
 from pathlib import Path
 from wiretap.config import settings
 from pydantic import parse_file_as
 from wiretap.schemas import Server
+from wiretap.kvstore import KeyValueStore
 
 
 lock = threading.Lock()
+_store = None
 
 
-def keyvalue_get(key: str):
-    path = Path(settings.base_path, "keyvalue.json")
-    if path.is_file():
+def _keyvalue_store():
+    global _store
+    if _store is None:
         with lock:
-            with open(path, "r") as fd:
-                data = json.load(fd)
-                return data.get(key)
-    return False
+            if _store is None:
+                _store = KeyValueStore()
+    return _store
+
+
+def keyvalue_get(key: str):
+    return _keyvalue_store().get(key)
 
 
 def keyvalue_set(key: str, value: str):
-    path = Path(settings.base_path, "keyvalue.json")
-    data = {}
-    with lock:
-        if path.is_file():
-            with open(path, "r") as fd:
-                data = json.load(fd)
-        data[key] = value
-        with open(path, "w") as fd:
-            json.dump(data, fd, indent=2)
+    _keyvalue_store().set(key, value)
 
 
 def read_inventory():
@@ -50,21 +47,6 @@ def read_config():
         raise RuntimeError(f"Could not read config file: {settings.config_file}")
 
 
-def get_hashes():
-    if not Path(settings.hash_file).is_file():
-        set_hashes([])
-    try:
-        with open(settings.hash_file, "r") as fd:
-            return set(json.load(fd))
-    except Exception:
-        raise RuntimeError(f"Could not read hash file: {settings.hash_file}")
-
-
-def set_hashes(hashes: list):
-    with open(settings.hash_file, "w") as fd:
-        json.dump(list(hashes), fd)
-
-
 def read_file(path):
     if not Path(path).is_file():
         write_file(path, [""])
@@ -90,39 +72,28 @@ def check_files():
     if not Path(settings.inventory_file).is_file():
         with open(settings.inventory_file, "w") as fd:
             json.dump([{"name": "Localhost", "host": "127.0.0.1"}], fd, indent=2)
-    if not Path(settings.hash_file).is_file():
-        with open(settings.hash_file, "w") as fd:
-            json.dump([], fd)
+    Path(settings.hash_dir).mkdir(parents=True, exist_ok=True)
     if not Path(settings.config_file).is_file():
         with open(settings.config_file, "w") as fd:
             json.dump({}, fd)
     if not Path(settings.metric_file).is_file():
-        fd.write("")
+        Path(settings.metric_file).touch()
+    Path(settings.segment_dir).mkdir(parents=True, exist_ok=True)
 
 
 def read_reverse_order(filename: str):
     with open(filename, "rb") as read_obj:
-        read_obj.seek(0, os.SEEK_END)
-        pointer_location = read_obj.tell()
-        buffer = bytearray()
-        while pointer_location >= 0:
-            read_obj.seek(pointer_location)
-            pointer_location = pointer_location - 1
-            new_byte = read_obj.read(1)
-            if new_byte == b"\n":
-                yield buffer.decode()[::-1]
-                buffer = bytearray()
-            else:
-                buffer.extend(new_byte)
-        if len(buffer) > 0:
-            yield buffer.decode()[::-1]
-
-
-def filestats(filename: str):
-    response = (
-        x
-        for x in subprocess.check_output(
-            f"wc -cl {filename}", shell=True, text=True
-        ).splitlines()
-    )
-    return next(response).strip().split(" ")[:2]
+        if not os.fstat(read_obj.fileno()).st_size:
+            return
+        with mmap.mmap(read_obj.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from reverse_lines(data)
+
+
+def reverse_lines(data):
+    """Yields the lines of *data* (bytes or mmap) decoded, last line first"""
+    end = len(data)
+    while end >= 0:
+        start = data.rfind(b"\n", 0, end)
+        yield data[start + 1 : end].decode()
+        end = start
+
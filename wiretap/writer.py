@@ -0,0 +1,109 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from influxdb_client import WritePrecision
+
+from wiretap.config import settings
+
+log = logging.getLogger()
+
+
+class Writer:
+    """Writes line protocol to InfluxDB in batches from a pool of worker threads
+
+    Collector threads only put their lists of encoded lines on a bounded queue. When the
+    queue is full *put* blocks for up to *block_timeout* seconds before the lines
+    are dropped, which gives the collectors backpressure without stalling them
+    forever. *close* also runs at exit, so the lines still queued or batched are
+    written before the worker threads, which are daemons, are gone.
+    """
+
+    def __init__(
+        self,
+        write_api,
+        bucket: str = settings.INFLUX_BUCKET_PREFIX,
+        batch_size: int = settings.WRITE_BATCH_SIZE,
+        flush_interval: float = settings.WRITE_FLUSH_INTERVAL,
+        queue_size: int = settings.WRITE_QUEUE_SIZE,
+        workers: int = settings.WRITE_WORKERS,
+        block_timeout: float = settings.WRITE_BLOCK_TIMEOUT,
+    ):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.threads = list()
+        for n in range(workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"thread_writer_{bucket}_{n}", daemon=True
+            )
+            self.threads.append(thread)
+            thread.start()
+        atexit.register(self.close)
+
+    def put(self, lines: list) -> bool:
+        """Queues the encoded *lines* for writing, returns False if they were dropped"""
+        try:
+            if self.block_timeout > 0:
+                self.queue.put(lines, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(lines)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(lines)
+            return False
+
+    def close(self):
+        """Flushes what is left on the queue and stops the workers"""
+        self._stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _worker(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                batch.extend(
+                    self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                )
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self._write(batch)
+                    batch = []
+                deadline = time.monotonic() + self.flush_interval
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: list):
+        try:
+            self.write_api.write(
+                self.bucket,
+                settings.INFLUX_ORG,
+                b"\n".join(batch),
+                write_precision=WritePrecision.S,
+            )
+            with self._lock:
+                self.written += len(batch)
+        except Exception as e:
+            log.error(
+                f"Could not write {len(batch)} lines to InfluxDB. ({type(e)}) {e}"
+            )
+            with self._lock:
+                self.failed += len(batch)